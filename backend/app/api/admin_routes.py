@@ -0,0 +1,62 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+from app.api.user_routes import get_current_admin
+from app.core.compression import compression_stats
+from app.core.tracing import trace_buffer
+from app.core.loop_monitor import loop_monitor
+from app.services.archive_service import ArchiveService
+from app.services.session_cache import get_session_cache
+from app.services.model_router import ModelRouter
+
+router = APIRouter()
+
+@router.post("/archive/run")
+async def run_archive(
+    days: Optional[int] = Query(None, ge=0),
+    current_user = Depends(get_current_admin)
+):
+    return await ArchiveService.archive_inactive(days)
+
+@router.get("/archive/stats")
+async def archive_stats(current_user = Depends(get_current_admin)):
+    return await ArchiveService.stats()
+
+@router.get("/compression/stats")
+async def compression_report(current_user = Depends(get_current_admin)):
+    report = {}
+    for encoding, entry in compression_stats.items():
+        saved = entry["raw_bytes"] - entry["compressed_bytes"]
+        report[encoding] = {
+            **entry,
+            "bytes_saved": saved,
+            "ratio": round(entry["compressed_bytes"] / entry["raw_bytes"], 3) if entry["raw_bytes"] else None,
+        }
+    return report
+
+@router.get("/traces")
+async def list_traces(
+    order: str = Query("slowest", pattern="^(slowest|recent)$"),
+    limit: int = Query(20, ge=1, le=200),
+    current_user = Depends(get_current_admin)
+):
+    traces = trace_buffer.slowest(limit) if order == "slowest" else trace_buffer.latest(limit)
+    return [t.to_dict() for t in traces]
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, current_user = Depends(get_current_admin)):
+    trace = trace_buffer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
+
+@router.get("/loop-lag")
+async def loop_lag(current_user = Depends(get_current_admin)):
+    return loop_monitor.stats()
+
+@router.get("/session-cache/stats")
+async def session_cache_stats(current_user = Depends(get_current_admin)):
+    return get_session_cache().stats()
+
+@router.get("/routing/stats")
+async def routing_stats(current_user = Depends(get_current_admin)):
+    return ModelRouter.stats()
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from app.core.security import verify_password, create_access_token, get_password_hash
 from app.core.database import db
 from app.models.user import UserCreate, UserInDB
@@ -25,7 +26,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
         )
-    if not verify_password(form_data.password, user["hashed_password"]):
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not await run_in_threadpool(verify_password, form_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -57,9 +59,10 @@ async def signup(user_in: UserSignup):
             detail="User with this email already exists"
         )
         
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await run_in_threadpool(get_password_hash, user_in.password)
+    # Role and account status are server-owned; new accounts always start from the defaults
     new_user = UserInDB(
-        **user_in.dict(exclude={"password"}), 
+        **user_in.dict(exclude={"password", "role", "is_active", "isBlocked"}), 
         hashed_password=hashed_password
     )
     
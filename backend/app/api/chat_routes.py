@@ -1,142 +1,445 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Request, Query, Header
 from typing import List, Optional
 from datetime import datetime
-from app.models.chat import ChatSession, Message
-from app.api.user_routes import get_current_user
+from app.models.chat import ChatSession, Message, BatchRequest, SERVER_MESSAGE_FIELDS
+from app.api.user_routes import get_current_admin, get_current_user
+from app.core.config import settings
 from app.core.database import db
+from app.core.http_cache import etag_matches, make_etag
+from app.core.tracing import span
 from app.services.ai_service import AiService
+from app.services.search_service import SearchService
+from app.services.archive_service import ArchiveService
+from app.services.usage_service import UsageService
+from app.services.sync_service import SyncService
+from app.services.batch_service import BatchService
+from app.services.session_cache import get_session_cache
+from app.services.model_router import ModelRouter, user_tier
+from app.services.idempotency_service import (
+    IdempotencyConflict, fingerprint, get_idempotency_store, holding, scoped_key
+)
 from bson import ObjectId
+import asyncio
 import json
-from fastapi.responses import StreamingResponse
+import logging
+import time
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Strong references for detached generation tasks
+_background_tasks = set()
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def check_quota(user_id: str):
+    if UsageService.is_over_quota(user_id):
+        raise HTTPException(status_code=429, detail="Daily token quota exceeded")
+
+_SESSION_INPUT_EXCLUDE = {"id": True, "messages": {"__all__": SERVER_MESSAGE_FIELDS}}
+
+def _session_from_ndjson(line: bytes, user_id: str) -> dict:
+    data = json.loads(line)
+    data.pop("_id", None)
+    data.pop("id", None)
+    # Imported sessions always belong to the importing user
+    data["user_id"] = user_id
+    return ChatSession(**data).dict(by_alias=True, exclude=_SESSION_INPUT_EXCLUDE)
+
 @router.post("/sessions", response_model=ChatSession)
 async def create_session(session: ChatSession, current_user = Depends(get_current_user)):
     database = db.get_db()
-    session_dict = session.dict(by_alias=True, exclude={"id"})
-    result = await database.chat_sessions.insert_one(session_dict)
+    session_dict = session.dict(by_alias=True, exclude=_SESSION_INPUT_EXCLUDE)
+    async with SyncService.reserve(session_dict["user_id"]) as seq:
+        session_dict["change_seq"] = seq
+        result = await database.chat_sessions.insert_one(session_dict)
+    SearchService.index_session(session_dict["user_id"], session_dict)
     
     # Update user's active session? Ideally frontend tracks this.
     return await database.chat_sessions.find_one({"_id": result.inserted_id})
 
 @router.get("/sessions", response_model=List[ChatSession])
-async def get_sessions(current_user = Depends(get_current_user)):
+async def get_sessions(request: Request, response: Response, current_user = Depends(get_current_user)):
     database = db.get_db()
-    cursor = database.chat_sessions.find({"user_id": str(current_user.get("_id"))}).sort("updated_at", -1)
-    return await cursor.to_list(length=100)
+    user_id = str(current_user.get("_id"))
 
-@router.post("/send")
-async def send_message(
-    session_id: str,
-    message: Message,
+    # Every write advances the user's change counter, so it versions the whole list.
+    # While a reserved write hasn't landed the counter is ahead of the data: send no ETag
+    seq = await SyncService.stable_seq(user_id)
+    if seq is not None:
+        etag = make_etag("sessions", user_id, seq)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    cursor = database.chat_sessions.find({"user_id": user_id}).sort("updated_at", -1)
+    sessions = await cursor.to_list(length=100)
+    return await ArchiveService.fill_messages(sessions)
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, current_user = Depends(get_current_user)):
+    database = db.get_db()
+    user_id = str(current_user.get("_id"))
+    try:
+        obj_id = ObjectId(session_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid Session ID")
+
+    result = await database.chat_sessions.delete_one({"_id": obj_id, "user_id": user_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Session not found")
+    await database.chat_archives.delete_one({"_id": obj_id})
+    await get_session_cache().invalidate(session_id)
+    await SyncService.record_deletion(user_id, session_id)
+    SearchService.remove_session(user_id, session_id)
+    return {"deleted": session_id}
+
+@router.get("/sync")
+async def sync_sessions(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    after: Optional[int] = Query(None, ge=0),
+    until: Optional[int] = Query(None, ge=0),
+    current_user = Depends(get_current_user)
+):
+    # Page with the same `since`, passing back `after` and `until=cursor` while has_more
+    return await SyncService.changes_since(str(current_user.get("_id")), since, limit, after, until)
+
+@router.get("/search")
+async def search_sessions(
+    q: str = Query(..., min_length=1),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
     current_user = Depends(get_current_user)
 ):
+    return await SearchService.search(str(current_user.get("_id")), q, page=page, limit=limit)
+
+@router.get("/export")
+async def export_sessions(current_user = Depends(get_current_user)):
     database = db.get_db()
-    
-    # 1. Verify session ownership
-    session = await database.chat_sessions.find_one({"_id": ObjectId(session_id), "user_id": str(current_user.get("_id"))})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    cursor = database.chat_sessions.find(
+        {"user_id": str(current_user.get("_id"))}
+    ).batch_size(settings.EXPORT_BATCH_SIZE)
 
-    # 2. Add User Message
-    user_message = message.dict()
-    user_message["timestamp"] = datetime.utcnow()
-    
-    await database.chat_sessions.update_one(
-        {"_id": ObjectId(session_id)},
-        {
-            "$push": {"messages": user_message},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
+    # One session (with its messages) per line, read straight off the cursor
+    async def ndjson_generator():
+        async for session in cursor:
+            if session.get("archived"):
+                await ArchiveService.fill_messages([session])
+                session.pop("archived", None)
+                session.pop("message_count", None)
+            yield json.dumps(session, default=json_default) + "\n"
+
+    return StreamingResponse(
+        ndjson_generator(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="chat_export.ndjson"'}
     )
 
-    # 3. Generate Title if new
-    if len(session.get("messages", [])) == 0:
+@router.post("/import")
+async def import_sessions(request: Request, current_user = Depends(get_current_user)):
+    database = db.get_db()
+    user_id = str(current_user.get("_id"))
+    start = time.perf_counter()
+
+    batch = []
+    imported = 0
+    skipped = 0
+    line_no = 0
+    pending = b""
+
+    async def flush():
+        nonlocal batch, imported
+        if batch:
+            async with SyncService.reserve(user_id, len(batch)) as last_seq:
+                for i, session in enumerate(batch):
+                    session["change_seq"] = last_seq - len(batch) + 1 + i
+                    # Seqs in the file belong to the exporting account's counter
+                    for message in session.get("messages", []):
+                        message["seq"] = session["change_seq"]
+                result = await database.chat_sessions.insert_many(batch, ordered=False)
+            imported += len(result.inserted_ids)
+            for session in batch:
+                SearchService.index_session(user_id, session)
+            batch = []
+
+    async def handle(line: bytes):
+        nonlocal skipped, line_no
+        line_no += 1
+        if not line.strip():
+            return
         try:
-            new_title = await AiService.generate_title(user_message["content"])
+            batch.append(_session_from_ndjson(line, user_id))
+        except Exception as e:
+            skipped += 1
+            logger.warning(f"Import: skipping line {line_no}: {e}")
+            return
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            await flush()
+
+    # Parse the body incrementally so memory stays bounded by one batch
+    async for chunk in request.stream():
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            await handle(line)
+    await handle(pending)
+    await flush()
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = imported / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Import: {imported} sessions for user {user_id} in {elapsed:.2f}s ({rows_per_sec:.0f} rows/s)")
+    return {
+        "imported": imported,
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows_per_sec, 1)
+    }
+
+async def load_owned_history(database, session_id: str, user_id: str) -> List[dict]:
+    """Recent messages of a session the user owns, served from the hot cache when possible."""
+    cache = get_session_cache()
+    with span("cache.session.get"):
+        cached = await cache.get(session_id)
+    if cached is not None:
+        if cached["user_id"] != user_id:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return cached["messages"]
+
+    try:
+        obj_id = ObjectId(session_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid Session ID")
+
+    # Appends that land while we read make this load stale; put() then skips caching it
+    generation = await cache.begin_load(session_id)
+    try:
+        with span("db.chat_sessions.find_one"):
+            session = await database.chat_sessions.find_one(
+                {"_id": obj_id, "user_id": user_id},
+                {"user_id": 1, "archived": 1, "messages": {"$slice": -settings.SESSION_CACHE_WINDOW}}
+            )
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if session.get("archived"):
+            with span("archive.rehydrate"):
+                session = await ArchiveService.rehydrate(session)
+
+        # Serve the same window a cache hit would, so model context doesn't depend on cache state
+        return await cache.put(session_id, user_id, session.get("messages", []), generation)
+    finally:
+        await cache.end_load(session_id)
+
+async def append_message(database, session_id: str, user_id: str, message: dict, touch: bool = True):
+    async with SyncService.reserve(user_id) as seq:
+        message["seq"] = seq
+        # $max keeps change_seq monotonic when concurrent appends land out of order
+        update = {"$push": {"messages": message}, "$max": {"change_seq": seq}}
+        if touch:
+            update["$set"] = {"updated_at": datetime.utcnow()}
+        with span("db.chat_sessions.update_one", role=message.get("role")):
+            await database.chat_sessions.update_one({"_id": ObjectId(session_id)}, update)
+    await get_session_cache().append(session_id, message)
+    SearchService.index_message(user_id, session_id, message.get("content", ""))
+
+async def set_generated_title(database, session_id: str, user_id: str, first_message: str):
+    try:
+        with span("ai.generate_title"):
+            new_title = await AiService.generate_title(first_message, user_id=user_id)
+        async with SyncService.reserve(user_id) as seq:
             await database.chat_sessions.update_one(
                 {"_id": ObjectId(session_id)},
-                {"$set": {"title": new_title}}
+                {"$set": {"title": new_title}, "$max": {"change_seq": seq}}
             )
-        except:
-            pass # Title gen failed, ignore
+        SearchService.index_title(user_id, session_id, new_title)
+    except:
+        pass # Title gen failed, ignore
+
+def build_ai_messages(history: List[dict], content: str) -> List[dict]:
+    messages_for_ai = [{"role": m["role"], "content": m["content"]} for m in history]
+    messages_for_ai.append({"role": "user", "content": content})
+    return messages_for_ai
+
+def _idempotency_key(user_id: str, endpoint: str, key: Optional[str], session_id: str, message: Message):
+    if not key:
+        return None, None
+    return scoped_key(user_id, endpoint, key), fingerprint(session_id, message.content, message.attachments)
+
+async def _claim_idempotency_key(store, key: str, fp: str):
+    try:
+        return await store.claim(key, fp)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+async def _send_message(database, session_id: str, user_id: str, message: Message, tier: str = "free") -> Message:
+    # 1. Verify session ownership
+    history = await load_owned_history(database, session_id, user_id)
+
+    # 2. Add User Message
+    user_message = message.dict(exclude=SERVER_MESSAGE_FIELDS)
+    user_message["timestamp"] = datetime.utcnow()
+    await append_message(database, session_id, user_id, user_message)
+
+    # 3. Generate Title if new
+    if len(history) == 0:
+        await set_generated_title(database, session_id, user_id, user_message["content"])
 
     # 4. Generate AI Response
     # Fetch recent history for context (last 10 messages)
-    history = session.get("messages", [])[-10:]
-    messages_for_ai = [
-        {"role": m["role"], "content": m["content"]} 
-        for m in history
-    ]
-    messages_for_ai.append({"role": "user", "content": user_message["content"]})
+    messages_for_ai = build_ai_messages(history[-10:], user_message["content"])
     
-    ai_response_content = await AiService.chat_completion(messages_for_ai)
+    decision = AiService.route_model("chat", messages_for_ai, tier)
+    ai_response_content = await AiService.chat_completion(messages_for_ai, model=decision["model"], user_id=user_id)
     
     ai_message = Message(
         role="assistant",
         content=ai_response_content,
-        timestamp=datetime.utcnow()
-    )
-    
-    await database.chat_sessions.update_one(
-        {"_id": ObjectId(session_id)},
-        {
-            "$push": {"messages": ai_message.dict()},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
+        timestamp=datetime.utcnow(),
+        model=decision["model"],
+        routing=decision
     )
-    
+    await append_message(database, session_id, user_id, ai_message.dict())
+    return ai_message
+
+@router.post("/send")
+async def send_message(
+    session_id: str,
+    message: Message,
+    current_user = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    database = db.get_db()
+    user_id = str(current_user.get("_id"))
+    key, fp = _idempotency_key(user_id, "send", idempotency_key, session_id, message)
+    if key is None:
+        check_quota(user_id)
+        return await _send_message(database, session_id, user_id, message, user_tier(current_user))
+
+    store = get_idempotency_store()
+    owner, _ = await _claim_idempotency_key(store, key, fp)
+    if not owner:
+        # Completed or still running: either way the duplicate gets the original answer
+        result = await store.wait_result(key)
+        if result is None:
+            raise HTTPException(status_code=409, detail="The original request for this Idempotency-Key failed; retry with a new key")
+        return JSONResponse(result, headers={"Idempotent-Replayed": "true"})
+
+    try:
+        check_quota(user_id)
+        async with holding(store, key):
+            ai_message = await _send_message(database, session_id, user_id, message, user_tier(current_user))
+    except BaseException:
+        await store.fail(key)
+        raise
+    await store.complete(key, json.loads(json.dumps(ai_message.dict(), default=json_default)))
     return ai_message
 
 @router.post("/send-stream")
 async def send_message_stream(
     session_id: str,
     message: Message,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     database = db.get_db()
-    
-    # Verify session
+    user_id = str(current_user.get("_id"))
+    key, fp = _idempotency_key(user_id, "send-stream", idempotency_key, session_id, message)
+    store = get_idempotency_store() if key else None
+
+    if key:
+        owner, _ = await _claim_idempotency_key(store, key, fp)
+        if not owner:
+            # Replay what the original request has streamed so far, then follow it live
+            return StreamingResponse(
+                store.replay(key),
+                media_type="text/event-stream",
+                headers={"Idempotent-Replayed": "true"}
+            )
+
     try:
-        obj_id = ObjectId(session_id)
-    except:
-        raise HTTPException(status_code=400, detail="Invalid Session ID")
-        
-    session = await database.chat_sessions.find_one({"_id": obj_id, "user_id": str(current_user.get("_id"))})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+        check_quota(user_id)
 
-    # Save User Msg
-    user_msg_dict = message.dict()
-    user_msg_dict["timestamp"] = datetime.utcnow()
-    await database.chat_sessions.update_one(
-        {"_id": obj_id},
-        {"$push": {"messages": user_msg_dict}}
-    )
+        # Verify session
+        history = await load_owned_history(database, session_id, user_id)
 
-    # History
-    history = session.get("messages", [])[-6:] # limit context
-    messages_for_ai = [{"role": m["role"], "content": m["content"]} for m in history]
-    messages_for_ai.append({"role": "user", "content": message.content})
+        # Save User Msg
+        user_msg_dict = message.dict(exclude=SERVER_MESSAGE_FIELDS)
+        user_msg_dict["timestamp"] = datetime.utcnow()
+        await append_message(database, session_id, user_id, user_msg_dict, touch=False)
+
+        # History
+        messages_for_ai = build_ai_messages(history[-6:], message.content) # limit context
+        decision = AiService.route_model("chat", messages_for_ai, user_tier(current_user))
+    except BaseException:
+        if key:
+            await store.fail(key)
+        raise
 
     async def event_generator():
         full_response = ""
-        async for chunk in AiService.chat_completion_stream(messages_for_ai):
+        async for chunk in AiService.chat_completion_stream(messages_for_ai, model=decision["model"], user_id=user_id):
             full_response += chunk
             yield chunk
 
         # Save AI Msg after stream completes
-        ai_msg = Message(role="assistant", content=full_response, timestamp=datetime.utcnow())
-        await database.chat_sessions.update_one(
-            {"_id": obj_id},
-            {
-                "$push": {"messages": ai_msg.dict()},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
+        ai_msg = Message(
+            role="assistant",
+            content=full_response,
+            timestamp=datetime.utcnow(),
+            model=decision["model"],
+            routing=decision
         )
+        await append_message(database, session_id, user_id, ai_msg.dict())
+
+    if not key:
+        return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+    # Generation is detached from this connection so a retry after a dropped
+    # connection can pick the stream up instead of paying for it again
+    async def produce():
+        try:
+            async with holding(store, key):
+                async for chunk in event_generator():
+                    await store.append_chunk(key, chunk)
+        except asyncio.CancelledError:
+            await store.fail(key)
+            raise
+        except Exception as e:
+            # Nothing awaits this task, so report the failure here rather than on the task
+            logger.error(f"Streaming for Idempotency-Key {key} failed: {e}")
+            await store.fail(key)
+            return
+        await store.complete(key)
+
+    task = asyncio.create_task(produce())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return StreamingResponse(store.replay(key), media_type="text/event-stream")
+
+@router.post("/batch")
+async def batch_completions(batch: BatchRequest, current_user = Depends(get_current_admin)):
+    # Internal jobs only: a batch fans out to hundreds of provider calls
+    user_id = str(current_user.get("_id"))
+    check_quota(user_id)
+    if not batch.prompts:
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    if batch.model and batch.model not in ModelRouter.models():
+        raise HTTPException(status_code=400, detail=f"Model must be one of: {', '.join(ModelRouter.models())}")
+    if len(batch.prompts) > settings.BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_PROMPTS} prompts per batch")
+
+    async def ndjson_generator():
+        async for result in BatchService.run(user_id, batch):
+            yield json.dumps(result, default=json_default) + "\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
 
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...), current_user = Depends(get_current_user)):
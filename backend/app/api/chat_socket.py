@@ -0,0 +1,205 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from typing import Dict, Optional
+from datetime import datetime
+from app.api.chat_routes import (
+    append_message, build_ai_messages, check_quota, load_owned_history,
+    set_generated_title, json_default
+)
+from app.api.user_routes import get_user_from_token
+from app.core.config import settings
+from app.core.database import db
+from app.models.chat import Message
+from app.services.ai_service import AiService
+from app.services.model_router import user_tier
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Close codes (RFC 6455 / IANA registry)
+WS_POLICY_VIOLATION = 1008
+WS_GOING_AWAY = 1001
+
+class ChatConnection:
+    """One authenticated socket carrying any number of tagged, interleaved completions.
+
+    Outbound frames go through a bounded queue drained by a single writer, so a
+    slow client blocks the producing streams instead of buffering without limit.
+    """
+
+    def __init__(self, websocket: WebSocket, user: Dict):
+        self.websocket = websocket
+        self.user_id = str(user.get("_id"))
+        self.tier = user_tier(user)
+        self.database = db.get_db()
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.streams = asyncio.Semaphore(settings.WS_MAX_CONCURRENT_STREAMS)
+        self.requests: Dict[str, asyncio.Task] = {}
+        self.background = set()
+        self.last_seen = time.monotonic()
+        self.closed = False
+
+    async def send(self, frame: Dict):
+        await self.outbox.put(frame)
+
+    def send_nowait(self, frame: Dict):
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            pass # control frames are droppable when the client isn't reading
+
+    async def writer(self):
+        while True:
+            frame = await self.outbox.get()
+            await self.websocket.send_text(json.dumps(frame, default=json_default))
+
+    async def heartbeat(self):
+        interval = settings.WS_HEARTBEAT_INTERVAL_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_seen > interval * 2:
+                logger.info(f"WS: closing idle connection for user {self.user_id}")
+                await self.websocket.close(code=WS_GOING_AWAY)
+                return
+            self.send_nowait({"type": "ping", "ts": time.time()})
+
+    async def reader(self):
+        while True:
+            try:
+                frame = json.loads(await self.websocket.receive_text())
+            except json.JSONDecodeError:
+                self.send_nowait({"type": "error", "detail": "Invalid JSON"})
+                continue
+            if not isinstance(frame, dict):
+                self.send_nowait({"type": "error", "detail": "Frames must be JSON objects"})
+                continue
+            self.last_seen = time.monotonic()
+            kind = frame.get("type")
+
+            if kind == "ping":
+                self.send_nowait({"type": "pong", "ts": frame.get("ts")})
+            elif kind == "pong":
+                continue
+            elif kind == "send":
+                self.start_request(frame)
+            elif kind == "cancel":
+                task = self.requests.get(str(frame.get("request_id")))
+                if task:
+                    task.cancel()
+            else:
+                self.send_nowait({"type": "error", "detail": f"Unknown frame type: {kind}"})
+
+    def start_request(self, frame: Dict):
+        request_id = frame.get("request_id")
+        if not request_id or not frame.get("session_id"):
+            self.send_nowait({"type": "error", "request_id": request_id, "detail": "request_id and session_id are required"})
+            return
+        request_id = str(request_id)
+        if request_id in self.requests:
+            self.send_nowait({"type": "error", "request_id": request_id, "detail": "Duplicate request_id"})
+            return
+        if len(self.requests) >= settings.WS_MAX_PENDING_REQUESTS:
+            self.send_nowait({"type": "error", "request_id": request_id, "detail": "Too many pending requests"})
+            return
+
+        task = asyncio.create_task(self.run_request(request_id, frame))
+        self.requests[request_id] = task
+        task.add_done_callback(lambda _: self.requests.pop(request_id, None))
+
+    async def run_request(self, request_id: str, frame: Dict):
+        session_id = str(frame["session_id"])
+        full_response = ""
+        decision = None
+        saved = False
+        async with self.streams:
+            try:
+                check_quota(self.user_id)
+                # Ownership and recent history come from the shared hot session cache
+                history = await load_owned_history(self.database, session_id, self.user_id)
+                is_new = len(history) == 0
+
+                message = Message(
+                    content=frame.get("content", ""),
+                    attachments=frame.get("attachments", [])
+                )
+                user_msg_dict = message.dict()
+                user_msg_dict["timestamp"] = datetime.utcnow()
+                await append_message(self.database, session_id, self.user_id, user_msg_dict)
+                messages_for_ai = build_ai_messages(history[-6:], message.content)
+                decision = AiService.route_model("chat", messages_for_ai, self.tier)
+
+                await self.send({"type": "start", "request_id": request_id, "session_id": session_id})
+                if is_new:
+                    title_task = asyncio.create_task(set_generated_title(self.database, session_id, self.user_id, message.content))
+                    self.background.add(title_task)
+                    title_task.add_done_callback(self.background.discard)
+
+                async for chunk in AiService.chat_completion_stream(messages_for_ai, model=decision["model"], user_id=self.user_id):
+                    full_response += chunk
+                    await self.send({"type": "chunk", "request_id": request_id, "data": chunk})
+
+                ai_msg = Message(role="assistant", content=full_response, timestamp=datetime.utcnow(), model=decision["model"], routing=decision)
+                await append_message(self.database, session_id, self.user_id, ai_msg.dict())
+                saved = True
+                await self.send({"type": "done", "request_id": request_id, "message": ai_msg.dict()})
+            except asyncio.CancelledError:
+                # Keep whatever the user already saw, unless it was stored before the cancel
+                if full_response and not saved:
+                    ai_msg = Message(role="assistant", content=full_response, timestamp=datetime.utcnow(), model=decision["model"], routing=decision)
+                    await append_message(self.database, session_id, self.user_id, ai_msg.dict())
+                # Terminal frames wait for room like chunks do; nobody reads them after teardown
+                if not self.closed:
+                    await self.send({"type": "cancelled", "request_id": request_id})
+            except HTTPException as e:
+                await self.send({"type": "error", "request_id": request_id, "status": e.status_code, "detail": e.detail})
+            except Exception as e:
+                logger.error(f"WS request {request_id} failed: {e}")
+                await self.send({"type": "error", "request_id": request_id, "status": 500, "detail": str(e)})
+
+    async def close(self):
+        self.closed = True
+        for task in list(self.requests.values()):
+            task.cancel()
+
+async def _authenticate(websocket: WebSocket, token: Optional[str]) -> Optional[Dict]:
+    try:
+        if not token:
+            frame = json.loads(await asyncio.wait_for(
+                websocket.receive_text(), timeout=settings.WS_AUTH_TIMEOUT_SECONDS
+            ))
+            if not isinstance(frame, dict) or frame.get("type") != "auth":
+                return None
+            token = frame.get("token")
+        return await get_user_from_token(token or "")
+    except (asyncio.TimeoutError, json.JSONDecodeError, HTTPException):
+        return None
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: Optional[str] = None):
+    await websocket.accept()
+    user = await _authenticate(websocket, token)
+    if user is None:
+        await websocket.close(code=WS_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+
+    connection = ChatConnection(websocket, user)
+    connection.send_nowait({"type": "ready", "user_id": connection.user_id})
+    tasks = [
+        asyncio.create_task(connection.reader()),
+        asyncio.create_task(connection.writer()),
+        asyncio.create_task(connection.heartbeat()),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exc = task.exception()
+            if exc and not isinstance(exc, WebSocketDisconnect):
+                logger.error(f"WS connection error for user {connection.user_id}: {exc}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await connection.close()
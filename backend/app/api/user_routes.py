@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from app.core.database import db
+from app.core.http_cache import etag_matches, make_etag
+from app.core.tracing import span
+from app.services.usage_service import UsageService
 from app.models.user import UserInDB, UserUpdate
 # from app.core.security import get_current_user # Replaced by local dependency below
 from typing import List
+from datetime import datetime
 
 router = APIRouter()
 
@@ -14,14 +18,15 @@ from app.core.database import db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        with span("auth.jwt_decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
@@ -29,21 +34,43 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
         
     database = db.get_db()
-    user = await database.users.find_one({"email": email})
+    with span("db.users.find_one"):
+        user = await database.users.find_one({"email": email})
     if user is None:
         raise credentials_exception
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await get_user_from_token(token)
+
+async def get_current_admin(current_user = Depends(get_current_user)):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return current_user
+
+def _user_etag(user) -> str:
+    version = user.get("updated_at") or user.get("created_at")
+    return make_etag("user", user.get("_id"), int(version.timestamp() * 1000) if version else 0)
+
 @router.get("/me", response_model=UserInDB)
-async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
+async def read_users_me(request: Request, response: Response, current_user: UserInDB = Depends(get_current_user)):
+    etag = _user_etag(current_user)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return current_user
 
+@router.get("/me/usage")
+async def read_my_usage(days: int = Query(30, ge=1, le=365), current_user = Depends(get_current_user)):
+    return await UsageService.get_usage(str(current_user.get("_id")), days=days)
+
 @router.put("/me", response_model=UserInDB)
 async def update_user_me(user_in: UserUpdate, current_user: UserInDB = Depends(get_current_user)):
     database = db.get_db()
     update_data = user_in.dict(exclude_unset=True)
     
     if update_data:
+        update_data["updated_at"] = datetime.utcnow()
         await database.users.update_one(
             {"_id": current_user["_id"]},
             {"$set": update_data}
@@ -0,0 +1,186 @@
+from typing import Dict, List, Optional, Tuple
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bytes seen by the middleware, exposed through the admin API
+compression_stats: Dict[str, Dict[str, int]] = {}
+
+def _record(encoding: str, raw: int, compressed: int):
+    entry = compression_stats.setdefault(encoding, {"responses": 0, "raw_bytes": 0, "compressed_bytes": 0})
+    entry["responses"] += 1
+    entry["raw_bytes"] += raw
+    entry["compressed_bytes"] += compressed
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    def allowed(coding: str) -> bool:
+        return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+def variant_etag(etag: str, encoding: str) -> str:
+    # A strong ETag must differ between encodings of the same resource
+    if etag.startswith('"') and etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+class _Encoder:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flush per chunk so streamed bodies reach the client without waiting for the encoder
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH)
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli for HTTP responses.
+
+    Bodies below `minimum_size` and excluded media types (token streams, NDJSON
+    exports) pass through untouched so streaming responses are never buffered.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        excluded_media_types: Tuple[str, ...] = ("text/event-stream", "application/x-ndjson"),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_media_types = excluded_media_types
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+        raw_bytes = 0
+        compressed_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough, raw_bytes, compressed_bytes
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                if message["status"] == 304:
+                    message["headers"] = self._rewrite_etag(message.get("headers", []), encoding)
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                response_headers = start_message.get("headers", [])
+                if self._should_skip(start_message["status"], response_headers, body, more_body):
+                    passthrough = True
+                else:
+                    encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+                    start_message["headers"] = self._compressed_headers(response_headers, encoding)
+                    if not more_body:
+                        compressed = encoder.finish(body)
+                        start_message["headers"].append((b"content-length", str(len(compressed)).encode()))
+                        message = {"type": "http.response.body", "body": compressed, "more_body": False}
+                        raw_bytes, compressed_bytes = len(body), len(compressed)
+                        body = None
+                await send(start_message)
+                start_message = None
+                if body is None:
+                    _record(encoding, raw_bytes, compressed_bytes)
+                    await send(message)
+                    return
+
+            if passthrough:
+                await send(message)
+                return
+
+            raw_bytes += len(body)
+            data = encoder.chunk(body) if more_body else encoder.finish(body)
+            compressed_bytes += len(data)
+            if not more_body:
+                _record(encoding, raw_bytes, compressed_bytes)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _should_skip(self, status: int, headers: List, body: bytes, more_body: bool) -> bool:
+        if status < 200 or status in (204, 304):
+            return True
+        for name, value in headers:
+            name = name.lower()
+            if name == b"content-encoding":
+                return True
+            if name == b"content-type":
+                media_type = value.decode("latin-1").split(";")[0].strip().lower()
+                if media_type in self.excluded_media_types:
+                    return True
+        return not more_body and len(body) < self.minimum_size
+
+    def _compressed_headers(self, headers: List, encoding: str) -> List:
+        result = []
+        for name, value in headers:
+            lower = name.lower()
+            if lower == b"content-length":
+                continue
+            if lower == b"etag":
+                value = variant_etag(value.decode("latin-1"), encoding).encode("latin-1")
+            result.append((name, value))
+        result.append((b"content-encoding", encoding.encode()))
+        result.append((b"vary", b"Accept-Encoding"))
+        return result
+
+    def _rewrite_etag(self, headers: List, encoding: str) -> List:
+        return [
+            (name, variant_etag(value.decode("latin-1"), encoding).encode("latin-1") if name.lower() == b"etag" else value)
+            for name, value in headers
+        ]
@@ -22,10 +22,92 @@ class Settings(BaseSettings):
     
     # OpenAI Settings
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "sk-...")
+    AI_EXECUTOR_WORKERS: int = int(os.getenv("AI_EXECUTOR_WORKERS", "10"))
+
+    # Model routing tiers
+    MODEL_FAST: str = os.getenv("MODEL_FAST", "openai/gpt-4o-mini")
+    MODEL_DEFAULT: str = os.getenv("MODEL_DEFAULT", "openai/gpt-3.5-turbo")
+    MODEL_LARGE: str = os.getenv("MODEL_LARGE", "openai/gpt-4o")
+    MODEL_FAST_CONTEXT_TOKENS: int = int(os.getenv("MODEL_FAST_CONTEXT_TOKENS", "128000"))
+    MODEL_DEFAULT_CONTEXT_TOKENS: int = int(os.getenv("MODEL_DEFAULT_CONTEXT_TOKENS", "16385"))
+    MODEL_LARGE_CONTEXT_TOKENS: int = int(os.getenv("MODEL_LARGE_CONTEXT_TOKENS", "128000"))
+    ROUTING_LATENCY_SLO_MS: float = float(os.getenv("ROUTING_LATENCY_SLO_MS", "8000")) # 0 disables
+    ROUTING_LARGE_PROMPT_TOKENS: int = int(os.getenv("ROUTING_LARGE_PROMPT_TOKENS", "12000"))
+    ROUTING_PREMIUM_TIERS: str = os.getenv("ROUTING_PREMIUM_TIERS", "premium,pro")
+    ROUTING_EXPECTED_COMPLETION_TOKENS: int = int(os.getenv("ROUTING_EXPECTED_COMPLETION_TOKENS", "300"))
+    ROUTING_LIGHT_COMPLETION_TOKENS: int = int(os.getenv("ROUTING_LIGHT_COMPLETION_TOKENS", "20"))
     
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "supersecretkey")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Export / Import
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "100"))
+    IMPORT_BATCH_SIZE: int = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+    # Sync
+    SYNC_RESERVATION_TIMEOUT_SECONDS: int = int(os.getenv("SYNC_RESERVATION_TIMEOUT_SECONDS", "30"))
+
+    # Search ("auto" uses the Mongo text index when available, "memory" forces the in-process index)
+    SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "auto")
+    SEARCH_INDEX_MAX_USERS: int = int(os.getenv("SEARCH_INDEX_MAX_USERS", "200"))
+    SEARCH_MAX_HIGHLIGHTS: int = int(os.getenv("SEARCH_MAX_HIGHLIGHTS", "3"))
+
+    # Cold-storage archival (interval 0 disables the background job; admins can still trigger it)
+    ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    ARCHIVE_INTERVAL_HOURS: float = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "0"))
+    ARCHIVE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+    ARCHIVE_COMPRESSION_LEVEL: int = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+    # Token usage accounting (quota 0 = unlimited)
+    USAGE_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "10"))
+    USAGE_DAILY_TOKEN_QUOTA: int = int(os.getenv("USAGE_DAILY_TOKEN_QUOTA", "0"))
+
+    # WebSocket chat transport
+    WS_AUTH_TIMEOUT_SECONDS: float = float(os.getenv("WS_AUTH_TIMEOUT_SECONDS", "10"))
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "20"))
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    WS_MAX_CONCURRENT_STREAMS: int = int(os.getenv("WS_MAX_CONCURRENT_STREAMS", "4"))
+    WS_MAX_PENDING_REQUESTS: int = int(os.getenv("WS_MAX_PENDING_REQUESTS", "16"))
+
+    # Response compression
+    COMPRESSION_MINIMUM_SIZE: int = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+    # Batch completions (concurrency is also bounded by AI_EXECUTOR_WORKERS threads)
+    BATCH_MAX_PROMPTS: int = int(os.getenv("BATCH_MAX_PROMPTS", "1000"))
+    BATCH_DEFAULT_CONCURRENCY: int = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    BATCH_WRITE_SIZE: int = int(os.getenv("BATCH_WRITE_SIZE", "100"))
+
+    # Idempotency keys ("memory" or "redis")
+    IDEMPOTENCY_BACKEND: str = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+    IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS", "120"))
+    IDEMPOTENCY_POLL_INTERVAL_SECONDS: float = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL_SECONDS", "0.1"))
+
+    # Request tracing and opt-in sampling profiler
+    TRACE_RECENT_SIZE: int = int(os.getenv("TRACE_RECENT_SIZE", "200"))
+    TRACE_SLOWEST_SIZE: int = int(os.getenv("TRACE_SLOWEST_SIZE", "50"))
+    PROFILE_ENABLED: bool = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+    PROFILE_THRESHOLD_MS: float = float(os.getenv("PROFILE_THRESHOLD_MS", "1000"))
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+
+    # Event-loop lag monitor
+    LOOP_MONITOR_ENABLED: bool = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+    LOOP_MONITOR_INTERVAL_MS: float = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+    LOOP_BLOCK_THRESHOLD_MS: float = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "200"))
+    LOOP_LAG_HISTORY: int = int(os.getenv("LOOP_LAG_HISTORY", "600"))
+
+    # Hot session cache ("memory", "redis" or "off"); the window must cover the 10-message send context
+    SESSION_CACHE_BACKEND: str = os.getenv("SESSION_CACHE_BACKEND", "memory")
+    SESSION_CACHE_WINDOW: int = int(os.getenv("SESSION_CACHE_WINDOW", "20"))
+    SESSION_CACHE_ENTRY_MAX_BYTES: int = int(os.getenv("SESSION_CACHE_ENTRY_MAX_BYTES", "65536"))
+    SESSION_CACHE_MAX_ENTRIES: int = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+    SESSION_CACHE_MAX_BYTES: int = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    SESSION_CACHE_TTL_SECONDS: int = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "3600"))
+
 settings = Settings()
@@ -9,6 +9,7 @@ class Database:
     client: AsyncIOMotorClient = None
     db = None
     redis = None
+    text_search_enabled: bool = False
 
     def get_db(self):
         if self.db is None:
@@ -37,6 +38,7 @@ async def connect_to_mongo():
         print("MONGO: Pinging admin...")
         await db.client.admin.command('ping')
         db.db = db.client[settings.DATABASE_NAME]
+        await create_indexes()
         print(f"MONGO: Successfully connected (Database: {settings.DATABASE_NAME})")
         logger.info(f"Successfully connected to MongoDB Cloud (Database: {settings.DATABASE_NAME})")
     except Exception as e:
@@ -50,6 +52,20 @@ async def connect_to_mongo():
         logger.error("="*40 + "!!!")
         # We don't raise the error so the app can still start and serve the /health page
 
+async def create_indexes():
+    await db.db.chat_sessions.create_index([("user_id", 1), ("change_seq", 1)])
+    await db.db.chat_tombstones.create_index([("user_id", 1), ("change_seq", 1)])
+    try:
+        await db.db.chat_sessions.create_index(
+            [("title", "text"), ("messages.content", "text")],
+            weights={"title": 5, "messages.content": 1},
+            name="chat_text_search"
+        )
+        db.text_search_enabled = True
+    except Exception as e:
+        db.text_search_enabled = False
+        logger.warning(f"Text index unavailable, falling back to in-process search index: {e}")
+
 async def close_mongo_connection():
     if db.client:
         db.client.close()
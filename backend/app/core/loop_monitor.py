@@ -0,0 +1,137 @@
+from app.core.config import settings
+from app.core.tracing import format_stack
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LoopBlockedError(AssertionError):
+    """Raised by loop_blocking_budget when the loop stalls longer than allowed."""
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class LoopLagMonitor:
+    """Measures event-loop scheduling delay and captures whatever is blocking it.
+
+    A coroutine sleeps for `interval` and records how late it wakes up. A
+    watchdog thread watches that heartbeat; when it goes stale by more than
+    `threshold`, the loop thread is stuck in sync code and its stack is saved.
+    """
+
+    def __init__(self, interval_ms: float, threshold_ms: float, history_size: int, max_events: int = 50):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lags_ms = deque(maxlen=history_size)
+        self.blocked_events = deque(maxlen=max_events)
+        self.last_tick = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._current_event: Optional[Dict] = None
+
+    def start(self):
+        """Must be called from the event-loop thread."""
+        self._loop_thread_id = threading.get_ident()
+        self.last_tick = time.perf_counter()
+        self._task = asyncio.create_task(self._probe())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _probe(self):
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag_ms = max(0.0, (now - before - self.interval) * 1000)
+            self.lags_ms.append(lag_ms)
+            self.last_tick = now
+
+            event = self._current_event
+            if event is not None:
+                # The stall is over; now we know how long it really was
+                event["blocked_ms"] = round(lag_ms, 1)
+                self._current_event = None
+                logger.warning(f"Event loop blocked for {lag_ms:.0f}ms at {event['stack'].rsplit(';', 1)[-1]}")
+
+    def _watchdog(self):
+        while not self._stop.wait(self.interval / 2):
+            stalled = time.perf_counter() - self.last_tick - self.interval
+            if stalled < self.threshold or self._current_event is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            event = {
+                "detected_at": datetime.utcnow().isoformat(),
+                "blocked_ms": round(stalled * 1000, 1),
+                "stack": format_stack(frame),
+            }
+            self._current_event = event
+            self.blocked_events.append(event)
+
+    def stats(self) -> Dict:
+        ordered = sorted(self.lags_ms)
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": len(ordered),
+            "lag_ms": {
+                "p50": round(_percentile(ordered, 50), 2),
+                "p90": round(_percentile(ordered, 90), 2),
+                "p99": round(_percentile(ordered, 99), 2),
+                "max": round(ordered[-1], 2) if ordered else 0.0,
+            },
+            "blocked_events": list(self.blocked_events)[::-1],
+        }
+
+loop_monitor = LoopLagMonitor(
+    settings.LOOP_MONITOR_INTERVAL_MS,
+    settings.LOOP_BLOCK_THRESHOLD_MS,
+    settings.LOOP_LAG_HISTORY,
+)
+
+@asynccontextmanager
+async def loop_blocking_budget(budget_ms: float, interval_ms: float = 5):
+    """Fail if the loop is blocked longer than `budget_ms` inside the block.
+
+    Meant for tests:
+
+        async with loop_blocking_budget(50):
+            await client.post("/api/v1/auth/login", ...)
+    """
+    interval = interval_ms / 1000
+    worst_ms = 0.0
+
+    async def probe():
+        nonlocal worst_ms
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(interval)
+            worst_ms = max(worst_ms, (time.perf_counter() - before - interval) * 1000)
+
+    task = asyncio.create_task(probe())
+    await asyncio.sleep(0)
+    try:
+        yield
+        # Give the probe a chance to wake up after a block at the very end
+        await asyncio.sleep(interval * 2)
+    finally:
+        task.cancel()
+
+    if worst_ms > budget_ms:
+        raise LoopBlockedError(f"Event loop was blocked for {worst_ms:.1f}ms (budget {budget_ms}ms)")
@@ -0,0 +1,240 @@
+from app.core.config import settings
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+import heapq
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = b"x-trace-id"
+
+class Trace:
+    def __init__(self, method: str, path: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.samples: Optional[Counter] = None # set when picked for profiling
+        self.profile: Optional[List[Dict]] = None
+
+    def add_span(self, name: str, start: float, end: float, **attrs):
+        span = {
+            "name": name,
+            "offset_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+        }
+        if attrs:
+            span["attrs"] = attrs
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "spans": self.spans,
+            "profile": self.profile,
+        }
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a stage of the current request; a no-op outside a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), **attrs)
+
+def record_span(name: str, start: float, end: float, **attrs):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, end, **attrs)
+
+class TraceBuffer:
+    """Recent traces plus a min-heap holding the slowest ones seen."""
+
+    def __init__(self, recent_size: int, slowest_size: int):
+        self.recent = deque(maxlen=recent_size)
+        self.slowest_size = slowest_size
+        self._slowest: List = []
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self.recent.append(trace)
+            entry = (trace.duration_ms, trace.trace_id, trace)
+            if len(self._slowest) < self.slowest_size:
+                heapq.heappush(self._slowest, entry)
+            elif trace.duration_ms > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self, limit: int) -> List[Trace]:
+        with self._lock:
+            return [t for _, _, t in heapq.nlargest(limit, self._slowest)]
+
+    def latest(self, limit: int) -> List[Trace]:
+        with self._lock:
+            return list(self.recent)[-limit:][::-1]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            for trace in list(self.recent) + [t for _, _, t in self._slowest]:
+                if trace.trace_id == trace_id:
+                    return trace
+        return None
+
+def format_stack(frame, limit: int = 40) -> str:
+    """Collapsed "file:function:line;..." stack, outermost first."""
+    parts = []
+    while frame is not None and len(parts) < limit:
+        code = frame.f_code
+        parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+class SamplingProfiler:
+    """Samples the event-loop thread's stack while profiled requests are running.
+
+    The loop interleaves requests, so a sample is credited to every profiled
+    request in flight at that moment; profiles are kept only for requests that
+    end up slower than the threshold.
+    """
+
+    def __init__(self, interval_ms: float, threshold_ms: float, sample_rate: float):
+        self.interval = interval_ms / 1000
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.active: Dict[str, Trace] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread_id: Optional[int] = None
+
+    def start(self):
+        self._target_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="trace-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def begin(self, trace: Trace):
+        if random.random() < self.sample_rate:
+            trace.samples = Counter()
+            with self._lock:
+                self.active[trace.trace_id] = trace
+
+    def end(self, trace: Trace):
+        if trace.samples is None:
+            return
+        with self._lock:
+            self.active.pop(trace.trace_id, None)
+        if trace.duration_ms >= self.threshold_ms and trace.samples:
+            total = sum(trace.samples.values())
+            trace.profile = [
+                {"stack": stack, "samples": count, "share": round(count / total, 3)}
+                for stack, count in trace.samples.most_common(20)
+            ]
+        trace.samples = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if not self.active:
+                    continue
+                traces = list(self.active.values())
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            stack = format_stack(frame)
+            for trace in traces:
+                samples = trace.samples
+                if samples is not None:
+                    samples[stack] += 1
+
+trace_buffer = TraceBuffer(settings.TRACE_RECENT_SIZE, settings.TRACE_SLOWEST_SIZE)
+profiler: Optional[SamplingProfiler] = None
+
+def start_profiler():
+    """Must be called from the event-loop thread (e.g. a startup hook)."""
+    global profiler
+    profiler = SamplingProfiler(
+        settings.PROFILE_INTERVAL_MS, settings.PROFILE_THRESHOLD_MS, settings.PROFILE_SAMPLE_RATE
+    )
+    profiler.start()
+
+def stop_profiler():
+    if profiler is not None:
+        profiler.stop()
+
+class TracingMiddleware:
+    """Opens a trace per HTTP request and returns its id in X-Trace-Id.
+
+    The trace closes when the last body chunk is sent, so streamed responses
+    are timed to completion rather than to their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope.get("method", ""), scope.get("path", ""))
+        token = _current_trace.set(trace)
+        active_profiler = profiler
+        if active_profiler is not None:
+            active_profiler.begin(trace)
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            trace.duration_ms = round((time.perf_counter() - trace.start) * 1000, 2)
+            if active_profiler is not None:
+                active_profiler.end(trace)
+            trace_buffer.add(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER, trace.trace_id.encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            trace.status = trace.status or 500
+            raise
+        finally:
+            finish()
+            _current_trace.reset(token)
@@ -4,7 +4,15 @@ from app.core.config import settings
 from app.api.auth import router as auth_router
 from app.api.user_routes import router as user_router
 from app.api.chat_routes import router as chat_router
-from app.core.database import connect_to_mongo, close_mongo_connection
+from app.api.chat_socket import router as chat_socket_router
+from app.api.admin_routes import router as admin_router
+from app.core.database import connect_to_mongo, close_mongo_connection, connect_to_redis, close_redis_connection
+from app.core.compression import CompressionMiddleware
+from app.core.tracing import TracingMiddleware, start_profiler, stop_profiler
+from app.core.loop_monitor import loop_monitor
+from app.services.archive_service import ArchiveService
+from app.services.usage_service import UsageService
+import asyncio
 import uvicorn
 import os
 
@@ -20,8 +28,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed", "X-Trace-Id"],
 )
 
+# Compression (skips token streams so they aren't buffered)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+)
+
+# Tracing (outermost, so spans cover every other middleware)
+app.add_middleware(TracingMiddleware)
+
 from fastapi import Request
 from fastapi.responses import JSONResponse
 import logging
@@ -30,7 +50,6 @@ import logging
 async def global_exception_handler(request: Request, exc: Exception):
     import traceback
     error_msg = f"Global Exception: {str(exc)}\n{traceback.format_exc()}"
-    print(error_msg)
     logging.error(error_msg)
     return JSONResponse(
         status_code=500,
@@ -41,6 +60,10 @@ async def global_exception_handler(request: Request, exc: Exception):
 app.include_router(auth_router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(user_router, prefix=f"{settings.API_V1_STR}/users", tags=["users"])
 app.include_router(chat_router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
+app.include_router(chat_socket_router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
+app.include_router(admin_router, prefix=f"{settings.API_V1_STR}/admin", tags=["admin"])
+
+background_tasks = []
 
 @app.on_event("startup")
 async def startup_event():
@@ -51,9 +74,26 @@ async def startup_event():
         traceback.print_exc()
         print(f"Startup failed: {e}")
 
+    if "redis" in (settings.IDEMPOTENCY_BACKEND, settings.SESSION_CACHE_BACKEND):
+        await connect_to_redis()
+    if settings.PROFILE_ENABLED:
+        start_profiler()
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    background_tasks.append(asyncio.create_task(UsageService.run_periodic()))
+    if settings.ARCHIVE_INTERVAL_HOURS > 0:
+        background_tasks.append(asyncio.create_task(ArchiveService.run_periodic()))
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    stop_profiler()
+    loop_monitor.stop()
+    await UsageService.flush()
     await close_mongo_connection()
+    await close_redis_connection()
 
 @app.get("/")
 def root():
@@ -1,7 +1,10 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
+# Stamped by the server when a message is stored, never taken from client input
+SERVER_MESSAGE_FIELDS = {"seq", "model", "routing"}
+
 class Message(BaseModel):
     role: str = "user"  # "user" or "assistant"
     content: str = ""
@@ -9,6 +12,9 @@ class Message(BaseModel):
     isUser: Optional[bool] = None # For frontend compatibility
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     attachments: List[str] = []
+    seq: Optional[int] = None # Change cursor position, set when the message is stored
+    model: Optional[str] = None
+    routing: Optional[Dict[str, Any]] = None # Model routing decision, for analysis
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -32,8 +38,21 @@ class ChatSession(BaseModel):
     title: Optional[str] = "New Chat"
     messages: List[Message] = []
     isPinned: bool = False
+    change_seq: Optional[int] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
         populate_by_name = True
+
+class BatchPrompt(BaseModel):
+    id: Optional[str] = None
+    prompt: Optional[str] = None
+    messages: Optional[List[Dict[str, str]]] = None # Full chat history instead of a single prompt
+    system: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    prompts: List[BatchPrompt]
+    model: Optional[str] = None
+    concurrency: Optional[int] = None
+    persist: bool = True
@@ -23,7 +23,9 @@ class UserInDB(UserBase):
     id: Optional[str] = Field(alias="_id", default=None)
     hashed_password: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = None
     settings: Dict[str, Any] = {}
+    tier: str = "free" # Plan tier, set server-side only (not in UserCreate/UserUpdate)
 
     class Config:
         populate_by_name = True
@@ -1,12 +1,16 @@
 from app.core.config import settings
 from app.core.database import db
+from app.services.usage_service import UsageService, estimate_tokens
+from app.core.tracing import record_span, span
+from app.services.model_router import ModelRouter
 from datetime import datetime
 import openai
 import logging
 import uuid
-from typing import List, Dict, AsyncGenerator
+from typing import List, Dict, AsyncGenerator, Optional
 import json
 import asyncio
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
@@ -24,7 +28,7 @@ def get_openai_client():
     return client
 
 # Create a ThreadPoolExecutor for run_in_executor
-executor = ThreadPoolExecutor(max_workers=10)
+executor = ThreadPoolExecutor(max_workers=settings.AI_EXECUTOR_WORKERS)
 
 class AiService:
     @staticmethod
@@ -39,27 +43,47 @@ class AiService:
             return []
 
     @staticmethod
-    async def chat_completion(messages: List[Dict], model: str = "openai/gpt-3.5-turbo") -> str:
+    def route_model(task: str, messages: List[Dict], tier: str = "free") -> Dict:
+        """Routing decision for a call; callers store it next to the message it produced."""
+        return ModelRouter.route(task, messages, tier)
+
+    @staticmethod
+    async def chat_completion(messages: List[Dict], model: Optional[str] = None, user_id: Optional[str] = None, raise_errors: bool = False, task: str = "chat") -> str:
+        if model is None:
+            model = AiService.route_model(task, messages)["model"]
         try:
             loop = asyncio.get_event_loop()
+            start = time.perf_counter()
             
             def sync_completion():
                 _client = get_openai_client()
-                response = _client.chat.completions.create(
+                return _client.chat.completions.create(
                     model=model,
                     messages=messages,
                 )
-                return response.choices[0].message.content
 
-            return await loop.run_in_executor(executor, sync_completion)
+            with span("ai.chat_completion", model=model):
+                response = await loop.run_in_executor(executor, sync_completion)
+            content = response.choices[0].message.content
+            AiService._record_usage(user_id, model, messages, content, getattr(response, "usage", None), start)
+            return content
         except Exception as e:
             logger.error(f"Chat completion error: {e}")
+            if raise_errors:
+                raise
             return "I apologize, but I encountered an error processing your request."
 
     @staticmethod
-    async def chat_completion_stream(messages: List[Dict], model: str = "openai/gpt-3.5-turbo") -> AsyncGenerator[str, None]:
+    async def chat_completion_stream(messages: List[Dict], model: Optional[str] = None, user_id: Optional[str] = None, task: str = "chat") -> AsyncGenerator[str, None]:
+        if model is None:
+            model = AiService.route_model(task, messages)["model"]
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        full_response = ""
+        usage = None
+        ttft_ms = None
+        stream = None
         try:
-            loop = asyncio.get_event_loop()
             
             def sync_stream():
                 _client = get_openai_client()
@@ -67,6 +91,7 @@ class AiService:
                     model=model,
                     messages=messages,
                     stream=True,
+                    stream_options={"include_usage": True},
                 )
 
             # Get the synchronous generator in a thread
@@ -86,20 +111,48 @@ class AiService:
                 chunk = await loop.run_in_executor(executor, get_next)
                 if chunk is None:
                     break
+
+                # The final chunk carries usage and has no choices
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
                     
                 content = chunk.choices[0].delta.content
                 if content:
+                    if not full_response:
+                        first_token = time.perf_counter()
+                        ttft_ms = (first_token - start) * 1000
+                        record_span("ai.stream.first_token", start, first_token, model=model)
+                    full_response += content
                     yield content
 
         except Exception as e:
             logger.error(f"Streaming error: {e}")
             yield f"Error: {str(e)}"
+        finally:
+            # Also runs on client disconnect / cancel, so tokens already generated still count
+            if stream is not None:
+                record_span("ai.chat_completion_stream", start, time.perf_counter(), model=model)
+                AiService._record_usage(user_id, model, messages, full_response, usage, start, ttft_ms)
+
+    @staticmethod
+    def _record_usage(user_id: Optional[str], model: str, messages: List[Dict], completion: str, usage, start: float, ttft_ms: Optional[float] = None):
+        latency_ms = (time.perf_counter() - start) * 1000
+        if usage is not None:
+            prompt_tokens = usage.prompt_tokens or 0
+            completion_tokens = usage.completion_tokens or 0
+        else:
+            prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+            completion_tokens = estimate_tokens(completion)
+        UsageService.record(user_id, model, prompt_tokens, completion_tokens, latency_ms)
+        ModelRouter.observe(model, ttft_ms, completion_tokens, latency_ms)
 
     @staticmethod
-    async def generate_title(first_message: str) -> str:
+    async def generate_title(first_message: str, user_id: Optional[str] = None) -> str:
         messages = [
             {"role": "system", "content": "You are a helpful assistant. Generate a short, 3-5 word title for this chat based on the user's first message. Do not use quotes."},
             {"role": "user", "content": first_message}
         ]
-        title = await AiService.chat_completion(messages)
+        title = await AiService.chat_completion(messages, user_id=user_id, task="title")
         return title.strip().replace('"', '')
@@ -0,0 +1,199 @@
+from app.core.config import settings
+from app.core.database import db
+from app.services.search_service import SearchService
+from app.services.session_cache import get_session_cache
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from bson import json_util
+import asyncio
+import gzip
+import logging
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+def _compress(raw: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=settings.ARCHIVE_COMPRESSION_LEVEL).compress(raw)
+    return "gzip", gzip.compress(raw, compresslevel=min(settings.ARCHIVE_COMPRESSION_LEVEL, 9))
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+def _decode_messages(archive: Dict) -> List[Dict]:
+    # json_util round-trips datetimes, so rehydrated messages match the originals
+    return json_util.loads(_decompress(archive["codec"], archive["blob"]))
+
+class ArchiveService:
+    # Process-local counters, reported alongside the totals stored in chat_archives
+    archived_sessions = 0
+    rehydrations = 0
+    rehydration_ms_total = 0.0
+    rehydration_ms_max = 0.0
+
+    @staticmethod
+    async def archive_inactive(days: int = None) -> Dict:
+        database = db.get_db()
+        days = days if days is not None else settings.ARCHIVE_AFTER_DAYS
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        start = time.perf_counter()
+
+        archived = 0
+        raw_total = 0
+        compressed_total = 0
+        cursor = database.chat_sessions.find(
+            {"updated_at": {"$lt": cutoff}, "archived": {"$ne": True}, "messages.0": {"$exists": True}},
+            {"messages": 1, "updated_at": 1, "change_seq": 1}
+        ).batch_size(settings.ARCHIVE_BATCH_SIZE)
+
+        async for session in cursor:
+            messages = session.get("messages", [])
+            raw = json_util.dumps(messages).encode("utf-8")
+            codec, blob = _compress(raw)
+
+            await database.chat_archives.replace_one(
+                {"_id": session["_id"]},
+                {
+                    "_id": session["_id"],
+                    "codec": codec,
+                    "blob": blob,
+                    "raw_bytes": len(raw),
+                    "compressed_bytes": len(blob),
+                    "archived_at": datetime.utcnow(),
+                },
+                upsert=True
+            )
+            # Only stub the session if nobody touched it while we were compressing. Some
+            # appends leave updated_at alone and $max can hide a late one, so check the count too
+            result = await database.chat_sessions.update_one(
+                {
+                    "_id": session["_id"],
+                    "updated_at": session["updated_at"],
+                    "change_seq": session.get("change_seq"),
+                    "messages": {"$size": len(messages)},
+                    "archived": {"$ne": True},
+                },
+                {
+                    "$set": {"archived": True, "message_count": len(messages)},
+                    "$unset": {"messages": ""}
+                }
+            )
+            if result.modified_count == 0:
+                await database.chat_archives.delete_one({"_id": session["_id"]})
+                continue
+            await get_session_cache().invalidate(str(session["_id"]))
+
+            archived += 1
+            raw_total += len(raw)
+            compressed_total += len(blob)
+
+        ArchiveService.archived_sessions += archived
+        elapsed = time.perf_counter() - start
+        logger.info(f"Archive: moved {archived} sessions idle for {days}+ days ({raw_total} -> {compressed_total} bytes) in {elapsed:.2f}s")
+        return {
+            "archived": archived,
+            "raw_bytes": raw_total,
+            "compressed_bytes": compressed_total,
+            "bytes_saved": raw_total - compressed_total,
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    @staticmethod
+    async def rehydrate(session: Dict) -> Dict:
+        """Move an archived session's messages back into chat_sessions and return the full session."""
+        if not session.get("archived"):
+            return session
+
+        database = db.get_db()
+        start = time.perf_counter()
+        archive = await database.chat_archives.find_one({"_id": session["_id"]})
+        if archive is None:
+            # A concurrent request already moved the messages back; read them from there
+            return await database.chat_sessions.find_one(
+                {"_id": session["_id"]},
+                {"user_id": 1, "archived": 1, "messages": 1}
+            ) or session
+        messages = _decode_messages(archive)
+
+        # $position 0 keeps anything pushed onto the stub after the archived history
+        result = await database.chat_sessions.update_one(
+            {"_id": session["_id"], "archived": True},
+            {
+                "$push": {"messages": {"$each": messages, "$position": 0}},
+                "$set": {"archived": False},
+                "$unset": {"message_count": ""}
+            }
+        )
+        await database.chat_archives.delete_one({"_id": session["_id"]})
+        if result.modified_count and session.get("user_id"):
+            # The archived history was never in the in-process search index
+            for m in messages:
+                SearchService.index_message(session["user_id"], session["_id"], m.get("content", ""))
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        ArchiveService.rehydrations += 1
+        ArchiveService.rehydration_ms_total += elapsed_ms
+        ArchiveService.rehydration_ms_max = max(ArchiveService.rehydration_ms_max, elapsed_ms)
+
+        session = dict(session)
+        session["messages"] = messages + session.get("messages", [])
+        session["archived"] = False
+        session.pop("message_count", None)
+        return session
+
+    @staticmethod
+    async def fill_messages(sessions: List[Dict]) -> List[Dict]:
+        """Decode archived messages in memory for read-only responses, without rehydrating."""
+        stubs = {s["_id"]: s for s in sessions if s.get("archived")}
+        if not stubs:
+            return sessions
+
+        database = db.get_db()
+        async for archive in database.chat_archives.find({"_id": {"$in": list(stubs)}}):
+            stub = stubs[archive["_id"]]
+            stub["messages"] = _decode_messages(archive) + stub.get("messages", [])
+        return sessions
+
+    @staticmethod
+    async def stats() -> Dict:
+        database = db.get_db()
+        totals = await database.chat_archives.aggregate([
+            {"$group": {
+                "_id": None,
+                "sessions": {"$sum": 1},
+                "raw_bytes": {"$sum": "$raw_bytes"},
+                "compressed_bytes": {"$sum": "$compressed_bytes"},
+            }}
+        ]).to_list(length=1)
+        stored = totals[0] if totals else {"sessions": 0, "raw_bytes": 0, "compressed_bytes": 0}
+        stored.pop("_id", None)
+        stored["bytes_saved"] = stored["raw_bytes"] - stored["compressed_bytes"]
+
+        rehydrations = ArchiveService.rehydrations
+        return {
+            "archive": stored,
+            "codec": "zstd" if zstandard is not None else "gzip",
+            "archived_since_start": ArchiveService.archived_sessions,
+            "rehydrations": rehydrations,
+            "rehydration_ms_avg": round(ArchiveService.rehydration_ms_total / rehydrations, 2) if rehydrations else 0.0,
+            "rehydration_ms_max": round(ArchiveService.rehydration_ms_max, 2),
+        }
+
+    @staticmethod
+    async def run_periodic():
+        interval = settings.ARCHIVE_INTERVAL_HOURS * 3600
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await ArchiveService.archive_inactive()
+            except Exception as e:
+                logger.error(f"Archive job failed: {e}")
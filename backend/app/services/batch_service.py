@@ -0,0 +1,96 @@
+from app.core.config import settings
+from app.core.database import db
+from app.models.chat import BatchPrompt, BatchRequest
+from app.services.ai_service import AiService
+from app.services.usage_service import UsageService
+from datetime import datetime
+from typing import AsyncGenerator, Dict, List
+from bson import ObjectId
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def _prompt_messages(item: BatchPrompt) -> List[Dict]:
+    messages = list(item.messages or [])
+    if item.prompt:
+        messages.append({"role": "user", "content": item.prompt})
+    if item.system:
+        messages.insert(0, {"role": "system", "content": item.system})
+    return messages
+
+class BatchService:
+    @staticmethod
+    async def run(user_id: str, request: BatchRequest) -> AsyncGenerator[Dict, None]:
+        """Run every prompt concurrently and yield results in completion order."""
+        batch_id = str(ObjectId())
+        concurrency = max(1, min(request.concurrency or settings.BATCH_DEFAULT_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY))
+        limiter = asyncio.Semaphore(concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        completion_kwargs = {"model": request.model} if request.model else {}
+        start = time.perf_counter()
+
+        async def run_one(index: int, item: BatchPrompt):
+            result = {"type": "result", "index": index, "id": item.id}
+            async with limiter:
+                call_start = time.perf_counter()
+                try:
+                    messages = _prompt_messages(item)
+                    if not messages:
+                        raise ValueError("Prompt is empty")
+                    # Long batches can cross the quota part-way through
+                    if UsageService.is_over_quota(user_id):
+                        raise ValueError("Daily token quota exceeded")
+                    result["content"] = await AiService.chat_completion(
+                        messages, user_id=user_id, raise_errors=True, task="batch", **completion_kwargs
+                    )
+                    result["status"] = "ok"
+                except Exception as e:
+                    result["status"] = "error"
+                    result["error"] = str(e)
+                result["latency_ms"] = round((time.perf_counter() - call_start) * 1000, 1)
+            await results.put(result)
+
+        tasks = [asyncio.create_task(run_one(i, item)) for i, item in enumerate(request.prompts)]
+        pending_writes: List[Dict] = []
+        completed = 0
+        failed = 0
+
+        async def flush():
+            if pending_writes and request.persist:
+                await db.get_db().batch_results.insert_many(list(pending_writes), ordered=False)
+            pending_writes.clear()
+
+        yield {"type": "batch", "batch_id": batch_id, "count": len(tasks), "concurrency": concurrency}
+        try:
+            for _ in range(len(tasks)):
+                result = await results.get()
+                if result["status"] == "ok":
+                    completed += 1
+                else:
+                    failed += 1
+                pending_writes.append({
+                    **result,
+                    "batch_id": batch_id,
+                    "user_id": user_id,
+                    "created_at": datetime.utcnow(),
+                })
+                if len(pending_writes) >= settings.BATCH_WRITE_SIZE:
+                    await flush()
+                yield result
+            await flush()
+        finally:
+            # The client may disconnect mid-batch; don't leave prompts running
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Batch {batch_id}: {completed} ok, {failed} failed in {elapsed:.1f}s (concurrency {concurrency})")
+        yield {
+            "type": "summary",
+            "batch_id": batch_id,
+            "completed": completed,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 3),
+        }
@@ -0,0 +1,236 @@
+from app.core.config import settings
+from app.core.database import db
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request."""
+
+def scoped_key(user_id: str, endpoint: str, key: str) -> str:
+    return f"{user_id}:{endpoint}:{key}"
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+class _Entry:
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.status = IN_FLIGHT
+        self.result: Any = None
+        self.chunks = []
+        self.failed = False
+        self.expires_at = expires_at
+        self.changed = asyncio.Condition()
+
+class InProcessIdempotencyStore:
+    """Keys and replay buffers for a single worker process.
+
+    In-flight entries are never expired here: their owner runs in this process
+    and always ends them with complete() or fail().
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._last_purge = time.monotonic()
+
+    def _purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < 30:
+            return
+        self._last_purge = now
+        for key in [k for k, e in self._entries.items() if e.status == COMPLETED and e.expires_at < now]:
+            del self._entries[key]
+
+    async def claim(self, key: str, fp: str) -> Tuple[bool, Optional[str]]:
+        """Return (owner, status). The first caller for a key becomes its owner."""
+        self._purge()
+        entry = self._entries.get(key)
+        if entry is not None and entry.status == COMPLETED and entry.expires_at < time.monotonic():
+            entry = None
+        if entry is None:
+            self._entries[key] = _Entry(fp, time.monotonic() + settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS)
+            return True, None
+        if entry.fingerprint != fp:
+            raise IdempotencyConflict()
+        return False, entry.status
+
+    async def keepalive(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires_at = time.monotonic() + settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS
+
+    async def append_chunk(self, key: str, chunk: str):
+        entry = self._entries[key]
+        async with entry.changed:
+            entry.chunks.append(chunk)
+            entry.expires_at = time.monotonic() + settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS
+            entry.changed.notify_all()
+
+    async def complete(self, key: str, result: Any = None):
+        entry = self._entries[key]
+        async with entry.changed:
+            entry.status = COMPLETED
+            entry.result = result
+            entry.expires_at = time.monotonic() + settings.IDEMPOTENCY_TTL_SECONDS
+            entry.changed.notify_all()
+
+    async def fail(self, key: str):
+        # Drop the key so a later retry runs again; current followers stop waiting
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            async with entry.changed:
+                entry.failed = True
+                entry.changed.notify_all()
+
+    async def wait_result(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        async with entry.changed:
+            await entry.changed.wait_for(lambda: entry.status == COMPLETED or entry.failed)
+        return None if entry.failed else entry.result
+
+    async def replay(self, key: str) -> AsyncGenerator[str, None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        sent = 0
+        while True:
+            async with entry.changed:
+                await entry.changed.wait_for(
+                    lambda: len(entry.chunks) > sent or entry.status == COMPLETED or entry.failed
+                )
+                new_chunks = entry.chunks[sent:]
+                finished = entry.status == COMPLETED or entry.failed
+            for chunk in new_chunks:
+                yield chunk
+            sent += len(new_chunks)
+            if finished and sent >= len(entry.chunks):
+                return
+
+class RedisIdempotencyStore:
+    """Same contract as the in-process store, shared across workers through Redis.
+
+    Followers poll, since a chunk list plus a state key is all Redis needs to hold.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _state_key(key: str) -> str:
+        return f"idem:{key}"
+
+    @staticmethod
+    def _chunks_key(key: str) -> str:
+        return f"idem:{key}:chunks"
+
+    async def _state(self, key: str) -> Optional[Dict]:
+        raw = await self.redis.get(self._state_key(key))
+        return json.loads(raw) if raw else None
+
+    async def claim(self, key: str, fp: str) -> Tuple[bool, Optional[str]]:
+        claimed = await self.redis.set(
+            self._state_key(key),
+            json.dumps({"status": IN_FLIGHT, "fingerprint": fp}),
+            nx=True,
+            ex=settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS
+        )
+        if claimed:
+            await self.redis.delete(self._chunks_key(key))
+            return True, None
+        state = await self._state(key)
+        if state is None:
+            # Expired between SET and GET; try once more
+            return await self.claim(key, fp)
+        if state["fingerprint"] != fp:
+            raise IdempotencyConflict()
+        return False, state["status"]
+
+    async def keepalive(self, key: str):
+        ttl = settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS
+        pipe = self.redis.pipeline()
+        pipe.expire(self._state_key(key), ttl)
+        pipe.expire(self._chunks_key(key), ttl)
+        await pipe.execute()
+
+    async def append_chunk(self, key: str, chunk: str):
+        ttl = settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._chunks_key(key), chunk)
+        pipe.expire(self._chunks_key(key), ttl)
+        pipe.expire(self._state_key(key), ttl)
+        await pipe.execute()
+
+    async def complete(self, key: str, result: Any = None):
+        state = await self._state(key)
+        if state is None:
+            # Owner outlived its lease; nothing left to hand the result to
+            logger.warning(f"Idempotency key {key} expired before completion")
+            return
+        state.update({"status": COMPLETED, "result": result})
+        await self.redis.set(self._state_key(key), json.dumps(state), ex=settings.IDEMPOTENCY_TTL_SECONDS)
+        await self.redis.expire(self._chunks_key(key), settings.IDEMPOTENCY_TTL_SECONDS)
+
+    async def fail(self, key: str):
+        await self.redis.delete(self._state_key(key), self._chunks_key(key))
+
+    async def wait_result(self, key: str) -> Optional[Any]:
+        while True:
+            state = await self._state(key)
+            if state is None:
+                return None
+            if state["status"] == COMPLETED:
+                return state.get("result")
+            await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+
+    async def replay(self, key: str) -> AsyncGenerator[str, None]:
+        sent = 0
+        while True:
+            state = await self._state(key)
+            chunks = await self.redis.lrange(self._chunks_key(key), sent, -1)
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            # State is read first, so a completed state means every chunk was in that lrange
+            if state is None or state["status"] == COMPLETED:
+                return
+            if not chunks:
+                await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def holding(store, key: str):
+    """Keep an in-flight key alive for as long as its owner is working on it."""
+    async def refresh():
+        while True:
+            await asyncio.sleep(settings.IDEMPOTENCY_IN_FLIGHT_TTL_SECONDS / 3)
+            await store.keepalive(key)
+
+    task = asyncio.create_task(refresh())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+_store = None
+
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        if settings.IDEMPOTENCY_BACKEND == "redis" and db.redis is not None:
+            _store = RedisIdempotencyStore(db.redis)
+        else:
+            if settings.IDEMPOTENCY_BACKEND == "redis":
+                logger.warning("Redis not connected, using in-process idempotency store")
+            _store = InProcessIdempotencyStore()
+    return _store
@@ -0,0 +1,148 @@
+from app.core.config import settings
+from app.services.usage_service import estimate_tokens
+from typing import Dict, List, Optional
+import logging
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+logger = logging.getLogger(__name__)
+
+# Tasks that never need more than the fast tier
+_LIGHT_TASKS = {"title", "summary"}
+
+# Starting estimates per tier until real measurements come in
+_PRIOR_TTFT_MS = {"fast": 600.0, "default": 900.0, "large": 1500.0}
+_PRIOR_TOKENS_PER_SEC = {"fast": 90.0, "default": 70.0, "large": 60.0}
+
+_EWMA_ALPHA = 0.2
+
+# Per-message framing overhead in the chat format
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+def count_prompt_tokens(messages: List[Dict]) -> int:
+    total = 0
+    for m in messages:
+        content = m.get("content") or ""
+        total += (len(_encoding.encode(content)) if _encoding is not None else estimate_tokens(content))
+        total += _MESSAGE_OVERHEAD_TOKENS
+    return total
+
+def user_tier(user: Optional[Dict]) -> str:
+    # Only the server-managed field; `settings` is user-writable through PUT /users/me
+    if not user:
+        return "free"
+    return user.get("tier") or "free"
+
+class _ModelStats:
+    def __init__(self, tier: str):
+        self.ttft_ms = _PRIOR_TTFT_MS[tier]
+        self.tokens_per_sec = _PRIOR_TOKENS_PER_SEC[tier]
+        self.samples = 0
+
+    def observe(self, ttft_ms: Optional[float], completion_tokens: int, duration_ms: float):
+        if ttft_ms is None:
+            # Non-streamed call: attribute everything past the expected TTFT to generation
+            ttft_ms = min(self.ttft_ms, duration_ms)
+        else:
+            self.ttft_ms += _EWMA_ALPHA * (ttft_ms - self.ttft_ms)
+        generation_ms = duration_ms - ttft_ms
+        if completion_tokens > 0 and generation_ms > 0:
+            rate = completion_tokens / (generation_ms / 1000)
+            self.tokens_per_sec += _EWMA_ALPHA * (rate - self.tokens_per_sec)
+        self.samples += 1
+
+    def predict_ms(self, completion_tokens: int) -> float:
+        return self.ttft_ms + completion_tokens / max(self.tokens_per_sec, 1.0) * 1000
+
+    def to_dict(self) -> Dict:
+        return {
+            "ttft_ms": round(self.ttft_ms, 1),
+            "tokens_per_sec": round(self.tokens_per_sec, 1),
+            "samples": self.samples,
+        }
+
+class ModelRouter:
+    """Picks a model per call from the configured fast/default/large tiers.
+
+    Light tasks go to the fast tier. Chat uses the default tier unless the
+    prompt is too big for it or the user's tier asks for the large model, and
+    falls back to a quicker tier when rolling TTFT/throughput predict the
+    choice would miss the latency SLO.
+    """
+
+    _stats: Dict[str, _ModelStats] = {}
+
+    @staticmethod
+    def _tiers() -> Dict[str, Dict]:
+        return {
+            "fast": {"model": settings.MODEL_FAST, "context": settings.MODEL_FAST_CONTEXT_TOKENS},
+            "default": {"model": settings.MODEL_DEFAULT, "context": settings.MODEL_DEFAULT_CONTEXT_TOKENS},
+            "large": {"model": settings.MODEL_LARGE, "context": settings.MODEL_LARGE_CONTEXT_TOKENS},
+        }
+
+    @staticmethod
+    def models() -> List[str]:
+        return [tier["model"] for tier in ModelRouter._tiers().values()]
+
+    @staticmethod
+    def _stats_for(model: str, tier: str = "default") -> _ModelStats:
+        stats = ModelRouter._stats.get(model)
+        if stats is None:
+            stats = ModelRouter._stats[model] = _ModelStats(tier)
+        return stats
+
+    @staticmethod
+    def route(task: str, messages: List[Dict], tier: str = "free") -> Dict:
+        tiers = ModelRouter._tiers()
+        prompt_tokens = count_prompt_tokens(messages)
+        expected_completion = (
+            settings.ROUTING_LIGHT_COMPLETION_TOKENS if task in _LIGHT_TASKS
+            else settings.ROUTING_EXPECTED_COMPLETION_TOKENS
+        )
+
+        def fits(name: str) -> bool:
+            return prompt_tokens + expected_completion <= tiers[name]["context"]
+
+        def predicted(name: str) -> float:
+            return ModelRouter._stats_for(tiers[name]["model"], name).predict_ms(expected_completion)
+
+        if task in _LIGHT_TASKS and fits("fast"):
+            choice, reason = "fast", "light_task"
+        elif prompt_tokens >= settings.ROUTING_LARGE_PROMPT_TOKENS or not fits("default"):
+            choice, reason = "large", "prompt_size"
+        elif tier in {t.strip() for t in settings.ROUTING_PREMIUM_TIERS.split(",")}:
+            choice, reason = "large", "user_tier"
+        else:
+            choice, reason = "default", "default"
+
+        # Trade down while the prediction misses the SLO, unless prompt size forced the choice
+        slo = settings.ROUTING_LATENCY_SLO_MS
+        if slo > 0 and task != "batch" and reason != "prompt_size":
+            order = ["large", "default", "fast"]
+            for candidate in order[order.index(choice) + 1:]:
+                if predicted(choice) <= slo:
+                    break
+                if fits(candidate) and predicted(candidate) < predicted(choice):
+                    choice, reason = candidate, f"{reason}+latency_slo"
+
+        return {
+            "model": tiers[choice]["model"],
+            "tier": choice,
+            "task": task,
+            "reason": reason,
+            "prompt_tokens": prompt_tokens,
+            "predicted_ms": round(predicted(choice), 1),
+        }
+
+    @staticmethod
+    def observe(model: str, ttft_ms: Optional[float], completion_tokens: int, duration_ms: float):
+        tier = next((name for name, t in ModelRouter._tiers().items() if t["model"] == model), "default")
+        ModelRouter._stats_for(model, tier).observe(ttft_ms, completion_tokens, duration_ms)
+
+    @staticmethod
+    def stats() -> Dict:
+        return {model: stats.to_dict() for model, stats in ModelRouter._stats.items()}
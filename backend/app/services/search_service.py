@@ -0,0 +1,278 @@
+from app.core.config import settings
+from app.core.database import db
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import logging
+import math
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "with",
+}
+
+# Sessions tokenized per worker-thread hop while building an index
+_BUILD_BATCH_SESSIONS = 50
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+_TITLE_BOOST = 2.0
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    return [
+        t for t in _TOKEN_RE.findall(text.lower())
+        if len(t) > 1 and t not in _STOPWORDS
+    ]
+
+class _UserIndex:
+    """Inverted index over one user's sessions (session id is the document)."""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> session -> tf
+        self.title_postings: Dict[str, Set[str]] = defaultdict(set)
+        self.session_titles: Dict[str, Set[str]] = {}
+        self.doc_lengths: Dict[str, int] = defaultdict(int)
+        self.total_length = 0
+
+    def add_text(self, session_id: str, text: str):
+        terms = tokenize(text)
+        for term in terms:
+            posting = self.postings[term]
+            posting[session_id] = posting.get(session_id, 0) + 1
+        self.doc_lengths[session_id] += len(terms)
+        self.total_length += len(terms)
+
+    def set_title(self, session_id: str, title: Optional[str]):
+        for term in self.session_titles.pop(session_id, ()):
+            self.title_postings[term].discard(session_id)
+        terms = set(tokenize(title or ""))
+        for term in terms:
+            self.title_postings[term].add(session_id)
+        self.session_titles[session_id] = terms
+        self.doc_lengths.setdefault(session_id, 0)
+
+    def remove_session(self, session_id: str):
+        self.set_title(session_id, None)
+        self.session_titles.pop(session_id, None)
+        for term in [t for t, posting in self.postings.items() if session_id in posting]:
+            del self.postings[term][session_id]
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(session_id, 0)
+
+    def search(self, terms: List[str]) -> List[Tuple[str, float]]:
+        n_docs = len(self.doc_lengths) or 1
+        avg_len = (self.total_length / n_docs) or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+
+        for term in set(terms):
+            posting = self.postings.get(term, {})
+            titled = self.title_postings.get(term, set())
+            df = len(posting.keys() | titled)
+            if df == 0:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for session_id, tf in posting.items():
+                norm = tf + _K1 * (1 - _B + _B * self.doc_lengths[session_id] / avg_len)
+                scores[session_id] += idf * tf * (_K1 + 1) / norm
+            for session_id in titled:
+                scores[session_id] += idf * _TITLE_BOOST
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def highlight(text: str, terms: List[str], width: int = 60) -> Optional[str]:
+    if not text or not terms:
+        return None
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")", re.IGNORECASE)
+    match = pattern.search(text)
+    if not match:
+        return None
+    start = max(0, match.start() - width)
+    end = min(len(text), match.end() + width)
+    snippet = pattern.sub(r"<mark>\1</mark>", text[start:end])
+    return ("..." if start > 0 else "") + snippet + ("..." if end < len(text) else "")
+
+class SearchService:
+    # Per-user in-process indexes, LRU-bounded; only used when Mongo text search is unavailable
+    _indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+    _build_locks: Dict[str, asyncio.Lock] = {}
+    # user_id -> sessions written while that user's index is being built
+    _touched_during_build: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def use_text_index() -> bool:
+        backend = settings.SEARCH_BACKEND
+        if backend == "memory":
+            return False
+        return db.text_search_enabled
+
+    @staticmethod
+    def _get_index(user_id: str) -> Optional[_UserIndex]:
+        index = SearchService._indexes.get(user_id)
+        if index is not None:
+            SearchService._indexes.move_to_end(user_id)
+        return index
+
+    @staticmethod
+    def _index_for_write(user_id: str, session_id) -> Optional[_UserIndex]:
+        # Unbuilt indexes pick writes up from Mongo; one being built re-reads what changed under it
+        index = SearchService._get_index(user_id)
+        if index is None:
+            touched = SearchService._touched_during_build.get(user_id)
+            if touched is not None:
+                touched.add(str(session_id))
+        return index
+
+    @staticmethod
+    def index_message(user_id: str, session_id, content: str):
+        index = SearchService._index_for_write(user_id, session_id)
+        if index is not None:
+            index.add_text(str(session_id), content)
+
+    @staticmethod
+    def index_title(user_id: str, session_id, title: Optional[str]):
+        index = SearchService._index_for_write(user_id, session_id)
+        if index is not None:
+            index.set_title(str(session_id), title)
+
+    @staticmethod
+    def remove_session(user_id: str, session_id):
+        index = SearchService._index_for_write(user_id, session_id)
+        if index is not None:
+            index.remove_session(str(session_id))
+
+    @staticmethod
+    def index_session(user_id: str, session: Dict):
+        index = SearchService._index_for_write(user_id, session["_id"])
+        if index is None:
+            return
+        session_id = str(session["_id"])
+        index.set_title(session_id, session.get("title"))
+        for m in session.get("messages", []):
+            index.add_text(session_id, m.get("content", ""))
+
+    @staticmethod
+    async def _ensure_index(user_id: str) -> _UserIndex:
+        index = SearchService._get_index(user_id)
+        if index is not None:
+            return index
+
+        lock = SearchService._build_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            index = SearchService._get_index(user_id)
+            if index is not None:
+                return index
+
+            start = time.perf_counter()
+            SearchService._touched_during_build[user_id] = set()
+            try:
+                index = await SearchService._build(user_id)
+            finally:
+                SearchService._touched_during_build.pop(user_id, None)
+
+            SearchService._indexes[user_id] = index
+            while len(SearchService._indexes) > settings.SEARCH_INDEX_MAX_USERS:
+                evicted, _ = SearchService._indexes.popitem(last=False)
+                SearchService._build_locks.pop(evicted, None)
+            logger.info(f"Search: built index for user {user_id} ({len(index.doc_lengths)} sessions) in {time.perf_counter() - start:.2f}s")
+            return index
+
+    @staticmethod
+    async def _build(user_id: str) -> _UserIndex:
+        index = _UserIndex()
+        database = db.get_db()
+        projection = {"title": 1, "messages.content": 1}
+        cursor = database.chat_sessions.find({"user_id": user_id}, projection)
+
+        # Tokenizing is CPU-bound; keep it off the event loop, one batch at a time
+        def add_batch(sessions: List[Dict]):
+            for session in sessions:
+                session_id = str(session["_id"])
+                index.set_title(session_id, session.get("title"))
+                for m in session.get("messages", []):
+                    index.add_text(session_id, m.get("content", ""))
+
+        batch = []
+        async for session in cursor:
+            batch.append(session)
+            if len(batch) >= _BUILD_BATCH_SESSIONS:
+                await run_in_threadpool(add_batch, batch)
+                batch = []
+        if batch:
+            await run_in_threadpool(add_batch, batch)
+
+        # Re-read sessions written during the build from scratch (deleted ones just drop out),
+        # until a pass sees no new writes; the caller publishes without awaiting in between
+        touched = SearchService._touched_during_build[user_id]
+        while touched:
+            SearchService._touched_during_build[user_id] = set()
+            for session_id in touched:
+                index.remove_session(session_id)
+            sessions = await database.chat_sessions.find(
+                {"user_id": user_id, "_id": {"$in": [ObjectId(s) for s in touched]}},
+                projection
+            ).to_list(length=None)
+            await run_in_threadpool(add_batch, sessions)
+            touched = SearchService._touched_during_build[user_id]
+        return index
+
+    @staticmethod
+    async def search(user_id: str, query: str, page: int = 1, limit: int = 20) -> Dict:
+        terms = tokenize(query)
+        response = {"query": query, "page": page, "limit": limit, "total": 0, "results": []}
+        if not terms:
+            return response
+
+        database = db.get_db()
+        skip = (page - 1) * limit
+
+        if SearchService.use_text_index():
+            text_filter = {"user_id": user_id, "$text": {"$search": query}}
+            cursor = database.chat_sessions.find(
+                text_filter,
+                {"title": 1, "updated_at": 1, "messages.content": 1, "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(limit)
+            sessions = await cursor.to_list(length=limit)
+            response["total"] = await database.chat_sessions.count_documents(text_filter)
+            scores = {s["_id"]: s.get("score", 0.0) for s in sessions}
+        else:
+            index = await SearchService._ensure_index(user_id)
+            ranked = index.search(terms)
+            response["total"] = len(ranked)
+            page_ids = [ObjectId(session_id) for session_id, _ in ranked[skip:skip + limit]]
+            scores = {ObjectId(session_id): score for session_id, score in ranked[skip:skip + limit]}
+            found = await database.chat_sessions.find(
+                {"_id": {"$in": page_ids}, "user_id": user_id},
+                {"title": 1, "updated_at": 1, "messages.content": 1}
+            ).to_list(length=limit)
+            by_id = {s["_id"]: s for s in found}
+            sessions = [by_id[i] for i in page_ids if i in by_id]
+
+        for session in sessions:
+            highlights = []
+            title_hit = highlight(session.get("title", ""), terms)
+            for m in session.get("messages", []):
+                snippet = highlight(m.get("content", ""), terms)
+                if snippet:
+                    highlights.append(snippet)
+                    if len(highlights) >= settings.SEARCH_MAX_HIGHLIGHTS:
+                        break
+            response["results"].append({
+                "session_id": str(session["_id"]),
+                "title": session.get("title"),
+                "title_highlight": title_hit,
+                "updated_at": session.get("updated_at"),
+                "score": round(scores.get(session["_id"], 0.0), 4),
+                "highlights": highlights,
+            })
+        return response
@@ -0,0 +1,251 @@
+from app.core.config import settings
+from app.core.database import db
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from bson import json_util
+from redis.exceptions import WatchError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead on top of the text itself (role, timestamps, dict)
+_MESSAGE_OVERHEAD_BYTES = 256
+
+# The byte cap never trims below this, the most history a send path feeds the model
+MIN_WINDOW_MESSAGES = 10
+
+def _message_bytes(message: Dict) -> int:
+    # `text` mirrors `content` for the frontend, so count the text once
+    return len(message.get("content") or message.get("text") or "") + _MESSAGE_OVERHEAD_BYTES
+
+class _Entry:
+    def __init__(self, user_id: str, messages: List[Dict]):
+        self.user_id = user_id
+        self.messages: List[Dict] = []
+        self.size = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Dict):
+        self.messages.append(message)
+        self.size += _message_bytes(message)
+        # Bound each entry by count and bytes, dropping the oldest messages first
+        while len(self.messages) > settings.SESSION_CACHE_WINDOW or (
+            len(self.messages) > MIN_WINDOW_MESSAGES
+            and self.size > settings.SESSION_CACHE_ENTRY_MAX_BYTES
+        ):
+            self.size -= _message_bytes(self.messages.pop(0))
+
+class InProcessSessionCache:
+    """LRU of session owner + recent message window, bounded by entries and bytes.
+
+    A miss is filled by reading Mongo between begin_load() and put(); writes to
+    the session in that gap bump its generation and the stale put is dropped.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # session_id -> [loads in progress, generation], only while a load is running
+        self._loads: Dict[str, List[int]] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def begin_load(self, session_id: str) -> int:
+        load = self._loads.setdefault(session_id, [0, 0])
+        load[0] += 1
+        return load[1]
+
+    async def end_load(self, session_id: str):
+        load = self._loads.get(session_id)
+        if load is not None:
+            load[0] -= 1
+            if load[0] <= 0:
+                del self._loads[session_id]
+
+    def _bump(self, session_id: str):
+        load = self._loads.get(session_id)
+        if load is not None:
+            load[1] += 1
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(session_id)
+        return {"user_id": entry.user_id, "messages": list(entry.messages)}
+
+    async def put(self, session_id: str, user_id: str, messages: List[Dict], generation: Optional[int] = None) -> List[Dict]:
+        """Cache the window and return it exactly as later hits will."""
+        entry = _Entry(user_id, messages[-settings.SESSION_CACHE_WINDOW:])
+        load = self._loads.get(session_id)
+        if generation is not None and load is not None and load[1] != generation:
+            # Written to while we were loading; the next request loads it again
+            return list(entry.messages)
+        await self.invalidate(session_id)
+        self._entries[session_id] = entry
+        self._size += entry.size
+        self._evict()
+        return list(entry.messages)
+
+    async def append(self, session_id: str, message: Dict):
+        # Write-through only; a session that isn't cached is loaded in full on next use
+        self._bump(session_id)
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        # A load that read Mongo after the write may have cached this message already
+        if message.get("seq") is not None and any(m.get("seq") == message["seq"] for m in entry.messages):
+            return
+        self._size -= entry.size
+        entry.append(message)
+        self._size += entry.size
+        self._entries.move_to_end(session_id)
+        self._evict()
+
+    async def invalidate(self, session_id: str):
+        self._bump(session_id)
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > settings.SESSION_CACHE_MAX_ENTRIES
+            or self._size > settings.SESSION_CACHE_MAX_BYTES
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class RedisSessionCache:
+    """Shared across workers; Redis TTLs and maxmemory policy take the place of the LRU."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _owner_key(session_id: str) -> str:
+        return f"session:{session_id}:owner"
+
+    @staticmethod
+    def _window_key(session_id: str) -> str:
+        return f"session:{session_id}:window"
+
+    @staticmethod
+    def _generation_key(session_id: str) -> str:
+        return f"session:{session_id}:gen"
+
+    async def begin_load(self, session_id: str) -> int:
+        return int(await self.redis.get(self._generation_key(session_id)) or 0)
+
+    async def end_load(self, session_id: str):
+        pass
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        pipe = self.redis.pipeline()
+        pipe.get(self._owner_key(session_id))
+        pipe.lrange(self._window_key(session_id), 0, -1)
+        owner, window = await pipe.execute()
+        if owner is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"user_id": owner, "messages": [json_util.loads(m) for m in window]}
+
+    async def put(self, session_id: str, user_id: str, messages: List[Dict], generation: Optional[int] = None) -> List[Dict]:
+        ttl = settings.SESSION_CACHE_TTL_SECONDS
+        window = messages[-settings.SESSION_CACHE_WINDOW:]
+        async with self.redis.pipeline() as pipe:
+            try:
+                # Only store if no worker wrote to the session since begin_load()
+                await pipe.watch(self._generation_key(session_id))
+                if generation is not None and int(await pipe.get(self._generation_key(session_id)) or 0) != generation:
+                    return list(window)
+                pipe.multi()
+                pipe.delete(self._window_key(session_id))
+                if window:
+                    pipe.rpush(self._window_key(session_id), *[json_util.dumps(m) for m in window])
+                    pipe.expire(self._window_key(session_id), ttl)
+                pipe.set(self._owner_key(session_id), user_id, ex=ttl)
+                await pipe.execute()
+            except WatchError:
+                pass
+        return list(window)
+
+    async def _bump(self, session_id: str) -> bool:
+        """Advance the generation; returns whether the session is cached."""
+        pipe = self.redis.pipeline()
+        pipe.incr(self._generation_key(session_id))
+        pipe.expire(self._generation_key(session_id), settings.SESSION_CACHE_TTL_SECONDS)
+        pipe.exists(self._owner_key(session_id))
+        _, _, cached = await pipe.execute()
+        return bool(cached)
+
+    async def append(self, session_id: str, message: Dict):
+        if not await self._bump(session_id):
+            return
+        ttl = settings.SESSION_CACHE_TTL_SECONDS
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._window_key(session_id), json_util.dumps(message))
+        pipe.ltrim(self._window_key(session_id), -settings.SESSION_CACHE_WINDOW, -1)
+        pipe.expire(self._window_key(session_id), ttl)
+        pipe.expire(self._owner_key(session_id), ttl)
+        await pipe.execute()
+
+    async def invalidate(self, session_id: str):
+        await self._bump(session_id)
+        await self.redis.delete(self._owner_key(session_id), self._window_key(session_id))
+
+    def stats(self) -> Dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+class _NoSessionCache:
+    async def get(self, session_id: str) -> Optional[Dict]:
+        return None
+
+    async def begin_load(self, session_id: str) -> int:
+        return 0
+
+    async def end_load(self, session_id: str):
+        pass
+
+    async def put(self, session_id: str, user_id: str, messages: List[Dict], generation: Optional[int] = None) -> List[Dict]:
+        return messages[-settings.SESSION_CACHE_WINDOW:]
+
+    async def append(self, session_id: str, message: Dict):
+        pass
+
+    async def invalidate(self, session_id: str):
+        pass
+
+    def stats(self) -> Dict:
+        return {"backend": "off"}
+
+_cache = None
+
+def get_session_cache():
+    global _cache
+    if _cache is None:
+        backend = settings.SESSION_CACHE_BACKEND
+        if backend == "off":
+            _cache = _NoSessionCache()
+        elif backend == "redis" and db.redis is not None:
+            _cache = RedisSessionCache(db.redis)
+        else:
+            if backend == "redis":
+                logger.warning("Redis not connected, using in-process session cache")
+            _cache = InProcessSessionCache()
+    return _cache
@@ -0,0 +1,160 @@
+from app.core.config import settings
+from app.core.database import db
+from app.core.tracing import span
+from app.services.archive_service import ArchiveService
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional
+from pymongo import ReturnDocument, UpdateOne
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _counter_id(user_id: str) -> str:
+    return f"chat:{user_id}"
+
+class SyncService:
+    """Per-user monotonic change cursor for chat data.
+
+    Every write to a user's sessions takes the next value of their counter and
+    stamps it on the session (change_seq) and on any pushed message (seq);
+    deletions leave a tombstone carrying the value instead.
+
+    Numbers are reserved before the write that carries them, so concurrent
+    writes can land out of order. Open reservations are listed on the counter
+    and sync never hands out a cursor past the lowest one.
+    """
+
+    @staticmethod
+    @asynccontextmanager
+    async def reserve(user_id: str, count: int = 1) -> AsyncIterator[int]:
+        """Reserve `count` sequence numbers for the write inside the block; yields the highest one."""
+        database = db.get_db()
+        with span("db.counters.reserve"):
+            counter = await database.counters.find_one_and_update(
+            {"_id": _counter_id(user_id)},
+                [{"$set": {
+                    "seq": {"$add": [{"$ifNull": ["$seq", 0]}, count]},
+                    "pending": {"$concatArrays": [
+                        {"$ifNull": ["$pending", []]},
+                        [{"seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]}, "at": "$$NOW"}]
+                    ]},
+                }}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        last = counter["seq"]
+        try:
+            yield last
+        finally:
+            await database.counters.update_one(
+                {"_id": _counter_id(user_id)},
+                {"$pull": {"pending": {"seq": last - count + 1}}}
+            )
+
+    @staticmethod
+    async def stable_seq(user_id: str) -> Optional[int]:
+        """Counter value when no reserved write is still outstanding, else None."""
+        database = db.get_db()
+        counter = await database.counters.find_one({"_id": _counter_id(user_id)})
+        if not counter:
+            return 0
+        return None if counter.get("pending") else counter["seq"]
+
+    @staticmethod
+    async def record_deletion(user_id: str, session_id: str):
+        database = db.get_db()
+        async with SyncService.reserve(user_id) as seq:
+            await database.chat_tombstones.insert_one({
+                "user_id": user_id,
+                "session_id": session_id,
+                "change_seq": seq,
+                "deleted_at": datetime.utcnow(),
+            })
+
+    @staticmethod
+    async def _backfill(user_id: str):
+        # Sessions written before change tracking existed get a cursor position on first full sync
+        database = db.get_db()
+        legacy = await database.chat_sessions.find(
+            {"user_id": user_id, "change_seq": {"$exists": False}},
+            {"_id": 1}
+        ).sort("updated_at", 1).to_list(length=None)
+        if not legacy:
+            return
+        async with SyncService.reserve(user_id, len(legacy)) as last:
+            first = last - len(legacy) + 1
+            await database.chat_sessions.bulk_write([
+                UpdateOne({"_id": s["_id"], "change_seq": {"$exists": False}}, {"$set": {"change_seq": first + i}})
+                for i, s in enumerate(legacy)
+            ], ordered=False)
+        logger.info(f"Sync: backfilled change_seq on {len(legacy)} sessions for user {user_id}")
+
+    @staticmethod
+    async def _settled_seq(user_id: str) -> int:
+        """Highest sequence number below which every reserved write has landed."""
+        database = db.get_db()
+        counter = await database.counters.find_one({"_id": _counter_id(user_id)})
+        if not counter:
+            return 0
+        # Reservations whose writer died never get released; stop waiting on them eventually
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.SYNC_RESERVATION_TIMEOUT_SECONDS)
+        open_seqs = [p["seq"] for p in counter.get("pending", []) if p["at"] > cutoff]
+        return min(open_seqs) - 1 if open_seqs else counter["seq"]
+
+    @staticmethod
+    async def changes_since(user_id: str, since: int, limit: int, after: Optional[int] = None, until: Optional[int] = None) -> Dict:
+        """Changes in (since, until], a page at a time.
+
+        `until` is fixed on the first page and `after` walks the pages by
+        change_seq; a session's change_seq is its latest change only, so
+        messages are always filtered against `since`. Clients store `cursor`
+        as their next `since` once `has_more` is false.
+        """
+        database = db.get_db()
+        if since == 0 and after is None:
+            await SyncService._backfill(user_id)
+        if until is None:
+            # Anything reserved after this read is numbered above it
+            until = await SyncService._settled_seq(user_id)
+        after = since if after is None else after
+
+        # Sessions changed past `until` are still scanned: they can hold older messages in the window
+        sessions: List[Dict] = await database.chat_sessions.find(
+            {"user_id": user_id, "change_seq": {"$gt": after}}
+        ).sort("change_seq", 1).limit(limit + 1).to_list(length=limit + 1)
+        tombstones: List[Dict] = await database.chat_tombstones.find(
+            {"user_id": user_id, "change_seq": {"$gt": after, "$lte": until}}
+        ).sort("change_seq", 1).limit(limit + 1).to_list(length=limit + 1)
+
+        # Merge both streams by sequence and cut at `limit` so a page never skips a change
+        changes = sorted(
+            [("session", s) for s in sessions] + [("deleted", t) for t in tombstones],
+            key=lambda change: change[1]["change_seq"]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        changed = [doc for kind, doc in changes if kind == "session"]
+        await ArchiveService.fill_messages(changed)
+
+        result_sessions = []
+        for session in changed:
+            messages = session.pop("messages", [])
+            session["_id"] = str(session["_id"])
+            session.pop("archived", None)
+            session.pop("message_count", None)
+            # Messages past `until` come with the session again on the next sync
+            session["messages"] = [
+                m for m in messages
+                if (since == 0 or (m.get("seq") or 0) > since) and (m.get("seq") or 0) <= until
+            ]
+            result_sessions.append(session)
+
+        return {
+            "cursor": until,
+            "has_more": has_more,
+            "after": changes[-1][1]["change_seq"] if has_more else None,
+            "sessions": result_sessions,
+            "deleted": [doc["session_id"] for kind, doc in changes if kind == "deleted"],
+        }
@@ -0,0 +1,160 @@
+from app.core.config import settings
+from app.core.database import db
+from datetime import datetime
+from typing import Dict, List, Tuple
+from pymongo import UpdateOne
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "total_tokens", "latency_ms")
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+def _model_key(model: str) -> str:
+    # Mongo field names can't contain dots ("gpt-3.5-turbo")
+    return model.replace(".", "_").replace("$", "_")
+
+def _empty_bucket() -> Dict:
+    bucket = {name: 0 for name in _COUNTERS}
+    bucket["models"] = {}
+    return bucket
+
+def _add(bucket: Dict, model: str, values: Dict):
+    model_bucket = bucket["models"].setdefault(_model_key(model), {name: 0 for name in _COUNTERS})
+    for name, value in values.items():
+        bucket[name] += value
+        model_bucket[name] += value
+
+def estimate_tokens(text: str) -> int:
+    # Rough local estimate (~4 chars per token) for providers that omit usage
+    return max(1, len(text) // 4) if text else 0
+
+class UsageService:
+    # (user_id, day) -> counters not yet written to the usage collection
+    _pending: Dict[Tuple[str, str], Dict] = {}
+    _in_flight: Dict[Tuple[str, str], Dict] = {}
+    # user_id -> (day, total_tokens) as of the last flush
+    _flushed_totals: Dict[str, Tuple[str, int]] = {}
+    _flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def record(user_id: str, model: str, prompt_tokens: int, completion_tokens: int, latency_ms: float):
+        if not user_id:
+            return
+        key = (user_id, _today())
+        bucket = UsageService._pending.setdefault(key, _empty_bucket())
+        _add(bucket, model, {
+            "requests": 1,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "latency_ms": int(latency_ms),
+        })
+
+    @staticmethod
+    def tokens_today(user_id: str) -> int:
+        """Tokens used today, answered from memory only (no DB read)."""
+        day = _today()
+        flushed_day, flushed = UsageService._flushed_totals.get(user_id, (day, 0))
+        total = flushed if flushed_day == day else 0
+        for pending in (UsageService._pending, UsageService._in_flight):
+            bucket = pending.get((user_id, day))
+            if bucket:
+                total += bucket["total_tokens"]
+        return total
+
+    @staticmethod
+    def is_over_quota(user_id: str) -> bool:
+        quota = settings.USAGE_DAILY_TOKEN_QUOTA
+        return quota > 0 and UsageService.tokens_today(user_id) >= quota
+
+    @staticmethod
+    async def flush():
+        if db.db is None:
+            return
+        async with UsageService._flush_lock:
+            if not UsageService._pending:
+                return
+            UsageService._in_flight, UsageService._pending = UsageService._pending, {}
+            batch = UsageService._in_flight
+
+            ops = []
+            for (user_id, day), bucket in batch.items():
+                inc = {name: bucket[name] for name in _COUNTERS}
+                for model, counters in bucket["models"].items():
+                    for name, value in counters.items():
+                        inc[f"models.{model}.{name}"] = value
+                ops.append(UpdateOne(
+                    {"_id": f"{user_id}:{day}"},
+                    {
+                        "$inc": inc,
+                        "$setOnInsert": {"user_id": user_id, "day": day},
+                        "$set": {"updated_at": datetime.utcnow()}
+                    },
+                    upsert=True
+                ))
+
+            try:
+                await db.db.usage.bulk_write(ops, ordered=False)
+            except Exception as e:
+                logger.error(f"Usage flush failed, keeping {len(ops)} counters for retry: {e}")
+                for key, bucket in batch.items():
+                    merged = UsageService._pending.setdefault(key, _empty_bucket())
+                    for model, counters in bucket["models"].items():
+                        _add(merged, model, counters)
+                UsageService._in_flight = {}
+                return
+
+            # The batch is in the DB now; carry it in _flushed_totals until the re-read lands
+            UsageService._in_flight = {}
+            for (user_id, day), bucket in batch.items():
+                flushed_day, flushed = UsageService._flushed_totals.get(user_id, (day, 0))
+                base = flushed if flushed_day == day else 0
+                UsageService._flushed_totals[user_id] = (day, base + bucket["total_tokens"])
+
+            # Refresh quota totals off the hot path (this also seeds users seen for the first time)
+            ids = [f"{user_id}:{day}" for user_id, day in batch]
+            async for doc in db.db.usage.find({"_id": {"$in": ids}}, {"user_id": 1, "day": 1, "total_tokens": 1}):
+                UsageService._flushed_totals[doc["user_id"]] = (doc["day"], doc.get("total_tokens", 0))
+
+    @staticmethod
+    async def run_periodic():
+        while True:
+            await asyncio.sleep(settings.USAGE_FLUSH_INTERVAL_SECONDS)
+            try:
+                await UsageService.flush()
+            except Exception as e:
+                logger.error(f"Usage flush loop error: {e}")
+
+    @staticmethod
+    async def get_usage(user_id: str, days: int = 30) -> Dict:
+        database = db.get_db()
+        cursor = database.usage.find({"user_id": user_id}).sort("day", -1).limit(days)
+        docs: List[Dict] = await cursor.to_list(length=days)
+        by_day = {doc["day"]: doc for doc in docs}
+
+        # Fold in counters that haven't been flushed yet
+        for pending in (UsageService._in_flight, UsageService._pending):
+            for (pending_user, day), bucket in pending.items():
+                if pending_user != user_id:
+                    continue
+                doc = by_day.setdefault(day, {"_id": f"{user_id}:{day}", "user_id": user_id, "day": day, **_empty_bucket()})
+                doc.setdefault("models", {})
+                for name in _COUNTERS:
+                    doc[name] = doc.get(name, 0) + bucket[name]
+                for model, counters in bucket["models"].items():
+                    model_doc = doc["models"].setdefault(model, {name: 0 for name in _COUNTERS})
+                    for name, value in counters.items():
+                        model_doc[name] = model_doc.get(name, 0) + value
+
+        daily = sorted(by_day.values(), key=lambda d: d["day"], reverse=True)[:days]
+        for doc in daily:
+            doc.pop("_id", None)
+        return {
+            "daily": daily,
+            "today_tokens": UsageService.tokens_today(user_id),
+            "daily_quota": settings.USAGE_DAILY_TOKEN_QUOTA or None,
+        }